@@ -48,6 +48,9 @@ CREATE TABLE IF NOT EXISTS flai.TBLFloodEvents (
 CREATE INDEX IF NOT EXISTS tblfloodevents_gix       ON flai.TBLFloodEvents USING GIST (geometry);
 CREATE INDEX IF NOT EXISTS tblfloodevents_date_idx  ON flai.TBLFloodEvents(beginDate);
 CREATE INDEX IF NOT EXISTS tblfloodevents_type_idx  ON flai.TBLFloodEvents(idEventType);
+CREATE INDEX IF NOT EXISTS tblfloodevents_fips_idx  ON flai.TBLFloodEvents(fips_county_code);
+-- Geography index for nearest-event (<->) ordering from a query point
+CREATE INDEX IF NOT EXISTS tblfloodevents_geog_gix  ON flai.TBLFloodEvents USING GIST ((geometry::geography));
 
 -- Trigger to autocomplete fips_county_code by spatial intersection
 CREATE OR REPLACE FUNCTION flai._set_event_county_from_point()
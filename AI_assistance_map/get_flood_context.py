@@ -11,20 +11,43 @@ This script provides an end-to-end pipeline for flood-related queries:
 
 from dotenv import load_dotenv
 import os
-import json
-import psycopg2
+import re
+import hashlib
+import orjson
+from psycopg2.pool import ThreadedConnectionPool
 import openai
 import requests
+from requests.adapters import HTTPAdapter
 import sys
 import time
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from typing import List, Literal, Optional
 from zoneinfo import ZoneInfo
-from select_function import select_relevant_context
+from pydantic import BaseModel, ConfigDict, ValidationError
+from select_function import get_cache, get_openai_client, rule_based_intent, select_relevant_context
 # from generate_pdf_report import generate_pdf_from_dict
 # from generate_markdown_report import generate_markdown_from_dict
 
 
+# Persistent caches for geocoding ('geo') and OpenAI responses ('llm'), shared
+# across runs of the script and opened on first use (see get_cache)
+LLM_CACHE_TTL = 86400 * 7
+
+# Query parsing is a small JSON extraction task; the full model is kept for the answer
+EXTRACTION_MODEL = "gpt-4o-mini"
+ANSWER_MODEL = "gpt-4o"
+
+
+def normalize_query(text):
+    """
+    Lowercases a query and collapses whitespace so trivially different
+    phrasings share cache entries.
+    """
+    return " ".join(text.lower().split())
+
+
 class GoogleMapsClient:
     """
     A client to interact with various Google Maps Platform APIs.
@@ -33,6 +56,7 @@ class GoogleMapsClient:
     ELEVATION_API_URL = "https://maps.googleapis.com/maps/api/elevation/json"
     TIMEZONE_API_URL = "https://maps.googleapis.com/maps/api/timezone/json"
     WEATHER_API_URL = "https://weather.googleapis.com/v1"
+    GEOCODE_CACHE_TTL = 86400 * 30  # Addresses rarely move; keep geocodes for 30 days
 
     def __init__(self, api_key):
         """
@@ -41,6 +65,11 @@ class GoogleMapsClient:
         if not api_key:
             raise ValueError("Google Maps API Key not found. Ensure your .env file is set up correctly.")
         self.api_key = api_key
+        # Shared keep-alive session so repeated calls reuse TCP/TLS connections.
+        # The pool is sized for the concurrent geocoding/forecast workers.
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=16, pool_maxsize=16)
+        self._session.mount("https://", adapter)
 
     def _make_request(self, url, params):
         """
@@ -48,7 +77,7 @@ class GoogleMapsClient:
         """
         params['key'] = self.api_key
         try:
-            response = requests.get(url, params=params)
+            response = self._session.get(url, params=params, timeout=10)
             response.raise_for_status()
             data = response.json()
             if 'error' in data:
@@ -66,19 +95,35 @@ class GoogleMapsClient:
             print(response.text, file=sys.stderr)
             return None
 
+    def _cached_request(self, cache_key, url, params):
+        """
+        Serves a request from the persistent geocoding cache, falling back to
+        the API on a miss. Failed lookups (including ZERO_RESULTS) come back
+        as None and are not cached.
+        """
+        data = get_cache('geo').get(cache_key)
+        if data is not None:
+            return data
+        data = self._make_request(url, params)
+        if data is not None:
+            get_cache('geo').set(cache_key, data, expire=self.GEOCODE_CACHE_TTL)
+        return data
+
     def geocode_by_address(self, address, language='en'):
         """
         Gets geolocation data from a text-based address.
         """
         params = {'address': address, 'language': language}
-        return self._make_request(self.GEOCODE_API_URL, params)
+        cache_key = ('geocode', normalize_query(address), language)
+        return self._cached_request(cache_key, self.GEOCODE_API_URL, params)
 
     def reverse_geocode(self, lat, lng, language='en'):
         """
         Gets geolocation data (reverse geocoding) from coordinates.
         """
         params = {'latlng': f"{lat},{lng}", 'language': language}
-        return self._make_request(self.GEOCODE_API_URL, params)
+        cache_key = ('reverse_geocode', round(lat, 6), round(lng, 6), language)
+        return self._cached_request(cache_key, self.GEOCODE_API_URL, params)
 
     def get_timezone(self, lat, lng):
         """
@@ -114,162 +159,169 @@ class GoogleMapsClient:
         return self._make_request(url, params)
 
 
-def extract_precipitation_time_request(user_input, openai_api_key):
+class ForecastRequest(BaseModel):
     """
-    Uses OpenAI to determine if the user is requesting precipitation forecast data
-    and extract the time duration requested.
-    Returns a dict with 'hours' and 'query_unit', or None if no forecast is requested.
+    Precipitation forecast request extracted from a query.
     """
-    try:
-        client = openai.OpenAI(api_key=openai_api_key)
-        prompt = f"""
-        You are an expert at analyzing user queries to determine if they are requesting
-        precipitation or rainfall forecast/prediction data.
-
-        Analyze the following query and determine:
-        1. Does the user want precipitation forecast/prediction data? (yes/no)
-        2. If yes, how many hours into the future? (extract the number and convert to hours)
-        3. What time unit did the user use in their query? (hours, days, or weeks)
+    model_config = ConfigDict(extra='forbid')
 
-        IMPORTANT: Convert time periods to hours:
-        - Days → multiply by 24 (e.g., "7 days" = 168 hours)
-        - Weeks → multiply by 168 (e.g., "1 week" = 168 hours)
-        - "tomorrow" = 24 hours
-        - "next week" = 168 hours
-        - "today" or "this afternoon" = 12 hours
+    requested: bool
+    hours: Optional[int]
+    query_unit: Optional[Literal['hours', 'days', 'weeks']]
 
-        Your answer MUST be a JSON object with these keys:
-        - "requested": boolean (true if precipitation forecast is requested, false otherwise)
-        - "hours": integer or null (number of hours if specified, null if not specified but requested, 0 if not requested)
-        - "query_unit": string ("hours", "days", or "weeks") - the unit the user used in their query
 
-        Examples:
-        - "What will the rainfall be like in the next 2 hours in Tuscaloosa?"
-          → {{"requested": true, "hours": 2, "query_unit": "hours"}}
-
-        - "Show me precipitation forecast for the next 24 hours"
-          → {{"requested": true, "hours": 24, "query_unit": "hours"}}
-
-        - "Will it rain tomorrow in Birmingham?"
-          → {{"requested": true, "hours": 24, "query_unit": "days"}}
-
-        - "Precipitation forecast for the next 7 days"
-          → {{"requested": true, "hours": 168, "query_unit": "days"}}
+class QueryExtraction(BaseModel):
+    """
+    Locations and forecast request extracted from a query by _request_query_intent.
+    """
+    model_config = ConfigDict(extra='forbid')
 
-        - "What's the forecast for the next 3 days?"
-          → {{"requested": true, "hours": 72, "query_unit": "days"}}
+    locations: List[str]
+    forecast: ForecastRequest
 
-        - "Weather for next week"
-          → {{"requested": true, "hours": 168, "query_unit": "weeks"}}
 
-        - "What is the flood history at this address?"
-          → {{"requested": false, "hours": 0, "query_unit": null}}
+# Strict structured output guarantees the extraction matches QueryExtraction
+QUERY_EXTRACTION_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "QueryExtraction",
+        "schema": QueryExtraction.model_json_schema(),
+        "strict": True
+    }
+}
 
-        - "Tell me about flooding in this area"
-          → {{"requested": false, "hours": 0, "query_unit": null}}
 
-        User query: '{user_input}'
-        """
-
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant that analyzes weather and precipitation queries."},
-                {"role": "user", "content": prompt}
-            ],
-            response_format={"type": "json_object"},
-        )
+def extract_query_intent(user_input, openai_api_key):
+    """
+    Uses a single OpenAI call to extract both the locations mentioned in a
+    user's query and whether (and for how long) a precipitation forecast is
+    requested.
 
-        content = response.choices[0].message.content
-        result = json.loads(content)
+    Returns:
+        Dict with 'locations' (list of location strings) and 'forecast'
+        (dict with 'hours' and 'query_unit', or None if no forecast is
+        requested), or None if the extraction failed.
+    """
+    # Only validated, normalized results are cached
+    cache_key = ('query_extraction', normalize_query(user_input))
+    cached = get_cache('llm').get(cache_key)
+    if cached is not None:
+        return cached
 
-        if result.get('requested', False):
-            hours = result.get('hours')
-            query_unit = result.get('query_unit', 'hours')  # Default to hours if not specified
-            # Default to 24 hours if requested but not specified
-            final_hours = hours if hours and hours > 0 else 24
-            return {
-                'hours': final_hours,
-                'query_unit': query_unit
+    try:
+        extraction = _request_query_intent(user_input, openai_api_key)
+
+        forecast = None
+        if extraction.forecast.requested:
+            hours = extraction.forecast.hours
+            forecast = {
+                # Default to 24 hours if requested but not specified
+                'hours': hours if hours and hours > 0 else 24,
+                'query_unit': extraction.forecast.query_unit or 'hours'  # Default to hours if not specified
             }
+        result = {
+            'locations': [name for name in extraction.locations if name.strip()],
+            'forecast': forecast
+        }
+    except openai.APIError as e:
+        print(f"OpenAI API Error: {e}", file=sys.stderr)
+        return None
+    except ValidationError as e:
+        print(f"Error: OpenAI response did not match the expected schema: {e}", file=sys.stderr)
         return None
-
     except Exception as e:
-        print(f"Error extracting precipitation time request: {e}", file=sys.stderr)
+        print(f"An unexpected error occurred with OpenAI: {e}", file=sys.stderr)
         return None
 
+    get_cache('llm').set(cache_key, result, expire=LLM_CACHE_TTL)
+    return result
 
-def extract_locations(user_input, openai_api_key):
+
+def _request_query_intent(user_input, openai_api_key):
     """
-    Uses OpenAI to extract and consolidate location names from a user's natural language input.
+    Asks OpenAI for the locations and forecast request in a query and
+    returns the validated QueryExtraction (raises ValidationError otherwise).
+    """
+    client = get_openai_client(openai_api_key)
+    prompt = f"""
+    You are an expert at analyzing flood and weather queries. From the user query, extract:
+
+    1. LOCATIONS: Identify locations and combine them into the most specific strings possible
+       for geocoding. If a specific place (like a building, park, or address) is mentioned
+       with its city or region, you MUST combine them into a single string. Do not split
+       a single conceptual place into multiple parts.
+
+    2. FORECAST: Determine whether the user wants precipitation or rainfall forecast/prediction
+       data, how many hours into the future, and which time unit they used (hours, days, or weeks).
+       Convert time periods to hours:
+       - Days → multiply by 24 (e.g., "7 days" = 168 hours)
+       - Weeks → multiply by 168 (e.g., "1 week" = 168 hours)
+       - "tomorrow" = 24 hours
+       - "next week" = 168 hours
+       - "today" or "this afternoon" = 12 hours
+
+    Your answer MUST be a JSON object with these keys:
+    - "locations": array of the final location strings
+    - "forecast": object with
+      - "requested": boolean (true if precipitation forecast is requested, false otherwise)
+      - "hours": integer or null (number of hours if specified, null if not specified but requested, 0 if not requested)
+      - "query_unit": string ("hours", "days", or "weeks") or null - the unit the user used in their query
+
+    Examples:
+    - "What is the weather forecast for the area around the Northeast Medical Building in Tuscaloosa?"
+      → {{"locations": ["Northeast Medical Building, Tuscaloosa"], "forecast": {{"requested": true, "hours": null, "query_unit": null}}}}
+
+    - "What will the rainfall be like in the next 2 hours in Tuscaloosa?"
+      → {{"locations": ["Tuscaloosa"], "forecast": {{"requested": true, "hours": 2, "query_unit": "hours"}}}}
+
+    - "Will it rain tomorrow in Birmingham?"
+      → {{"locations": ["Birmingham"], "forecast": {{"requested": true, "hours": 24, "query_unit": "days"}}}}
+
+    - "Precipitation forecast for the next 7 days in Mobile and Huntsville"
+      → {{"locations": ["Mobile", "Huntsville"], "forecast": {{"requested": true, "hours": 168, "query_unit": "days"}}}}
+
+    - "Weather for next week at the Eiffel Tower"
+      → {{"locations": ["Eiffel Tower, Paris"], "forecast": {{"requested": true, "hours": 168, "query_unit": "weeks"}}}}
+
+    - "What is the flood history at 500 Main Street, Montgomery?"
+      → {{"locations": ["500 Main Street, Montgomery"], "forecast": {{"requested": false, "hours": 0, "query_unit": null}}}}
+
+    User query: '{user_input}'
     """
-    try:
-        client = openai.OpenAI(api_key=openai_api_key)
-        prompt = f"""
-        You are an expert geographer at identifying and consolidating location information from text.
-        Your task is to extract locations and combine them into the most specific strings possible
-        for geocoding. If a specific place (like a building, park, or address) is mentioned
-        with its city or region, you MUST combine them into a single string. Do not split
-        a single conceptual place into multiple parts.
-
-        Your answer MUST be a JSON object with a single key named "result", which contains an
-        array of the final location strings.
-
-        Example 1:
-        - User query: 'What is the weather forecast for the area around the Northeast Medical Building in Tuscaloosa?'
-        - Correct output: {{"result": ["Northeast Medical Building, Tuscaloosa"]}}
-
-        Example 2:
-        - User query: 'I want to know the elevation of the Eiffel Tower and the weather in Rome.'
-        - Correct output: {{"result": ["Eiffel Tower, Paris", "Rome"]}}
-
-        Now, process the following query:
-        User query: '{user_input}'
-        """
 
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": "You are a helpful and precise location extraction assistant that consolidates location information."},
-                {"role": "user", "content": prompt}
-            ],
-            response_format={"type": "json_object"},
-        )
+    response = client.chat.completions.create(
+        model=EXTRACTION_MODEL,
+        messages=[
+            {"role": "system", "content": "You are a helpful and precise assistant that extracts locations and forecast requests from weather queries."},
+            {"role": "user", "content": prompt}
+        ],
+        response_format=QUERY_EXTRACTION_RESPONSE_FORMAT,
+    )
 
-        content = response.choices[0].message.content
-        locations = json.loads(content)
-        return locations
-    except openai.APIError as e:
-        print(f"OpenAI API Error: {e}", file=sys.stderr)
-        return None
-    except json.JSONDecodeError:
-        print(f"Error: OpenAI did not return valid JSON. Response was: {content}", file=sys.stderr)
-        return None
-    except Exception as e:
-        print(f"An unexpected error occurred with OpenAI: {e}", file=sys.stderr)
-        return None
+    content = response.choices[0].message.content
+    return QueryExtraction.model_validate_json(content)
 
 
-def extract_coordinates(user_query, maps_client, openai_api_key):
+def extract_coordinates(location_names, maps_client):
     """
-    Extracts locations from a query, geocodes them, and returns a list of
+    Geocodes the locations extracted from a query and returns a list of
     dictionaries containing location information.
     """
-    print(f"Processing user query: '{user_query}'\n", file=sys.stderr)
-
     geocoded_locations = []
 
-    locations = extract_locations(user_query, openai_api_key)
-    if not locations or 'result' not in locations or not locations['result']:
+    if not location_names:
         print("No locations were identified in the user query.", file=sys.stderr)
         return geocoded_locations
 
-    print(f"Locations identified by OpenAI: {locations['result']}\n", file=sys.stderr)
+    print(f"Locations identified by OpenAI: {location_names}\n", file=sys.stderr)
+
+    # Geocode all locations concurrently, keeping the extraction order
+    with ThreadPoolExecutor(max_workers=min(8, len(location_names))) as executor:
+        geo_results = list(executor.map(maps_client.geocode_by_address, location_names))
 
-    for location_name in locations['result']:
+    for location_name, geo_data in zip(location_names, geo_results):
         print(f"--- Geocoding: {location_name} ---", file=sys.stderr)
 
-        geo_data = maps_client.geocode_by_address(location_name)
         if not geo_data or not geo_data.get('results'):
             print(f"Could not geocode '{location_name}'. Moving to the next location.\n", file=sys.stderr)
             continue
@@ -294,8 +346,9 @@ def extract_coordinates(user_query, maps_client, openai_api_key):
     return geocoded_locations
 
 
-def execute_query(conn, query, params=None, fetch=False):
-    """Execute a SQL query with optional parameters."""
+def execute_query(pool, query, params=None, fetch=False):
+    """Execute a SQL query with optional parameters on a pooled connection."""
+    conn = pool.getconn()
     cur = conn.cursor()
     try:
         if params:
@@ -314,153 +367,177 @@ def execute_query(conn, query, params=None, fetch=False):
         return None
     finally:
         cur.close()
+        pool.putconn(conn)
 
 
-def get_county_info(connection, lat, lon):
-    """
-    Finds the county that contains the given coordinates.
-    """
-    query = """
-        SELECT c.fips_county_code, c.County, s.State, c.areaSQMI
+# Upper bound on flood events returned per location (nearest first)
+MAX_FLOOD_EVENTS = 100
+
+# Resolves the county containing the point once and gathers everything the
+# pipeline needs for it (precipitation history, flood events, SVI) in a single
+# round-trip. Postgres shapes the result into the final JSON payload, which
+# psycopg2 parses straight into dicts and lists.
+# Prepared once per pooled connection; parameters are $1 = longitude,
+# $2 = latitude, $3 = SVI release year.
+PREPARE_CONTEXT_QUERY = f"""
+    PREPARE get_all_context(float8, float8, integer) AS
+    WITH p AS (
+        SELECT
+            ST_Transform(ST_SetSRID(ST_MakePoint($1, $2), 4326), 5070) AS g,
+            ST_SetSRID(ST_MakePoint($1, $2), 4326)::geography AS geog
+    ),
+    county AS (
+        SELECT c.fips_county_code, c.County AS county_name, s.State AS state_name, c.areaSQMI AS area_sqmi
         FROM flai.TCLCounties c
         JOIN flai.TCLStates s ON c.idState = s.idState
-        WHERE ST_Intersects(c.geometry, ST_Transform(ST_SetSRID(ST_MakePoint(%s, %s), 4326), 5070));
-    """
-    result = execute_query(connection, query, params=(lon, lat), fetch=True)
-
-    if result:
-        row = result[0]
-        return {
-            "fips_code": row[0],
-            "county_name": row[1],
-            "state_name": row[2],
-            "area_sqmi": float(row[3])
-        }
-    return None
+        CROSS JOIN p
+        -- && lets the planner use the GiST index on TCLCounties.geometry
+        WHERE c.geometry && p.g AND ST_Intersects(c.geometry, p.g)
+        LIMIT 1
+    ),
+    hist AS (
+        SELECT json_agg(
+            json_build_object(
+                'year', mp.year,
+                'month', mp.month,
+                'precipitation_in', COALESCE(mp.totalPrecipitation_in, 0)::float8
+            )
+            ORDER BY mp.year, mp.month
+        ) AS rows
+        FROM flai.TBLMonthlyPrecipitation mp
+        JOIN county USING (fips_county_code)
+    ),
+    floods AS (
+        SELECT json_agg(
+            json_build_object(
+                'type', f.event_type,
+                'date', f.begin_date,
+                'distance_from_query_point_miles', round((f.distance_meters * 0.000621371)::numeric, 2)::float8,
+                'warning_zone', f.warning_zone,
+                'county', COALESCE(f.county_name, 'Not Assigned (e.g., Offshore)'),
+                'location', json_build_object('latitude', f.latitude, 'longitude', f.longitude)
+            )
+            ORDER BY f.distance_meters ASC
+        ) AS rows
+        FROM (
+            SELECT
+                et.EventType AS event_type,
+                e.beginDate AS begin_date,
+                e.warning_zone,
+                county.county_name,
+                ST_Y(e.geometry) AS latitude,
+                ST_X(e.geometry) AS longitude,
+                e.geometry::geography <-> p.geog AS distance_meters
+            FROM flai.TBLFloodEvents e
+            JOIN county USING (fips_county_code)
+            JOIN flai.TCLEventTypes et ON e.idEventType = et.idEventType
+            CROSS JOIN p
+            -- KNN ordering served by the GiST index on (geometry::geography)
+            ORDER BY e.geometry::geography <-> p.geog
+            LIMIT {MAX_FLOOD_EVENTS}
+        ) f
+    ),
+    svi AS (
+        -- Rows with no variable are theme-level scores; the rest are variables
+        SELECT CASE WHEN count(*) = 0 THEN NULL ELSE json_build_object(
+            'release_year', $3,
+            'overall_ranking', json_build_object(
+                'national', (array_agg(s.overallNational))[1]::float8,
+                'state', (array_agg(s.overallState))[1]::float8
+            ),
+            'themes', COALESCE(
+                json_object_agg(t.Theme, s.SVIValue::float8) FILTER (WHERE v.SVIVariable IS NULL),
+                '{{}}'::json
+            ),
+            'variables', COALESCE(
+                json_object_agg(v.SVIVariable, s.SVIValue::float8) FILTER (WHERE v.SVIVariable IS NOT NULL),
+                '{{}}'::json
+            )
+        ) END AS doc
+        FROM flai.TBLSVI s
+        JOIN county USING (fips_county_code)
+        JOIN flai.TCLSVIThemes t ON s.idSVITheme = t.idSVITheme
+        LEFT JOIN flai.TCLSVIVariables v ON s.idSVIVariable = v.idSVIVariable
+        WHERE s.release_year = $3
+    )
+    SELECT json_build_object(
+        'county_data', json_build_object(
+            'fips_code', county.fips_county_code,
+            'county_name', county.county_name,
+            'state_name', county.state_name,
+            'area_sqmi', county.area_sqmi::float8
+        ),
+        'precipitation_history', COALESCE((SELECT rows FROM hist), '[]'::json),
+        'flood_event_history', COALESCE((SELECT rows FROM floods), '[]'::json),
+        'social_vulnerability_index', (SELECT doc FROM svi)
+    )
+    FROM county;
+"""
 
 
-def get_precipitation_history(connection, fips_code):
+class PreparedConnectionPool(ThreadedConnectionPool):
     """
-    Retrieves the monthly precipitation history for a given county.
+    Thread-safe connection pool that prepares the hot lookup statement on
+    every new connection, so Postgres parses and plans it only once per
+    connection instead of on every call.
     """
-    query = """
-        SELECT year, month, totalPrecipitation_in
-        FROM flai.TBLMonthlyPrecipitation
-        WHERE fips_county_code = %s
-        ORDER BY year, month;
-    """
-    results = execute_query(connection, query, params=(fips_code,), fetch=True)
-    return [
-        {"year": row[0], "month": row[1], "precipitation_in": float(row[2])}
-        for row in results
-    ]
 
+    def _connect(self, key=None):
+        conn = super()._connect(key)
+        cur = conn.cursor()
+        try:
+            cur.execute(PREPARE_CONTEXT_QUERY)
+            conn.commit()
+        finally:
+            cur.close()
+        return conn
 
-def get_flood_history(connection, fips_code, maps_client, user_lat, user_lon):
-    """
-    Retrieves a detailed list of historical flood events for a given county,
-    calculates the distance from a user-specified point, and sorts the results
-    by proximity (nearest first).
+
+def get_all_context(pool, lat, lon, svi_year=2022):
     """
-    query = """
-        SELECT
-            et.EventType,
-            e.beginDate,
-            e.warning_zone,
-            c.County,
-            ST_Y(e.geometry) AS latitude,
-            ST_X(e.geometry) AS longitude,
-            ST_Distance(
-                e.geometry::geography,
-                ST_SetSRID(ST_MakePoint(%s, %s), 4326)::geography
-            ) as distance_meters
-        FROM flai.TBLFloodEvents e
-        JOIN flai.TCLEventTypes et ON e.idEventType = et.idEventType
-        LEFT JOIN flai.TCLCounties c ON e.fips_county_code = c.fips_county_code
-        WHERE e.fips_county_code = %s
-        ORDER BY distance_meters ASC;
-    """
-    params = (user_lon, user_lat, fips_code)
-    results = execute_query(connection, query, params=params, fetch=True)
-
-    event_list = []
-    if not results:
-        return event_list
-
-    print(f"Found {len(results)} historical flood events. Sorting by distance and reverse geocoding...", file=sys.stderr)
-    for row in results:
-        lat = row[4]
-        lon = row[5]
-        distance_meters = row[6]
-
-        # Convert meters to miles
-        distance_miles = distance_meters * 0.000621371
+    Retrieves the county, monthly precipitation history, historical flood
+    events, and Social Vulnerability Index (SVI) data for the given
+    coordinates in one database round-trip.
 
-        address = "N/A"
-        if lat and lon:
-            geo_data = maps_client.reverse_geocode(lat, lon)
-            if geo_data and geo_data.get('results'):
-                address = geo_data['results'][0]['formatted_address']
+    Returns:
+        Dict with 'county_data', 'precipitation_history', 'flood_event_history'
+        (nearest first, not yet reverse geocoded) and
+        'social_vulnerability_index', or None if no county contains the point.
+    """
+    result = execute_query(
+        pool,
+        "EXECUTE get_all_context(%s, %s, %s);",
+        params=(lon, lat, svi_year),
+        fetch=True
+    )
 
-        event_details = {
-            "type": row[0],
-            "date": row[1].isoformat(),
-            "distance_from_query_point_miles": round(distance_miles, 2),
-            "warning_zone": row[2],
-            "county": row[3] if row[3] else "Not Assigned (e.g., Offshore)",
-            "location": {
-                "latitude": lat,
-                "longitude": lon
-            },
-            "nearest_address": address
-        }
-        event_list.append(event_details)
+    if not result:
+        return None
 
-    return event_list
+    return result[0][0]
 
 
-def get_svi_data(connection, fips_code, release_year=2022):
+def get_flood_history(flood_events, maps_client):
     """
-    Retrieves the Social Vulnerability Index (SVI) data for a given county and year.
+    Adds the nearest street address to each historical flood event returned by
+    get_all_context (already sorted by proximity, nearest first).
     """
-    query = """
-        SELECT
-            s.overallNational,
-            s.overallState,
-            t.Theme,
-            v.SVIVariable,
-            s.SVIValue
-        FROM flai.TBLSVI s
-        JOIN flai.TCLSVIThemes t ON s.idSVITheme = t.idSVITheme
-        LEFT JOIN flai.TCLSVIVariables v ON s.idSVIVariable = v.idSVIVariable
-        WHERE s.fips_county_code = %s AND s.release_year = %s;
-    """
-    results = execute_query(connection, query, params=(fips_code, release_year), fetch=True)
-
-    if not results:
-        return None
-
-    svi_data = {
-        "release_year": release_year,
-        "overall_ranking": {
-            "national": float(results[0][0]) if results[0][0] is not None else None,
-            "state": float(results[0][1]) if results[0][1] is not None else None
-        },
-        "themes": {},
-        "variables": {}
-    }
+    if not flood_events:
+        return []
 
-    for row in results:
-        theme_name = row[2]
-        variable_name = row[3]
-        svi_value = float(row[4]) if row[4] is not None else None
+    print(f"Found {len(flood_events)} historical flood events. Reverse geocoding...", file=sys.stderr)
+    for event in flood_events:
+        lat = event['location']['latitude']
+        lon = event['location']['longitude']
 
-        if variable_name is None:
-            svi_data["themes"][theme_name] = svi_value
-        else:
-            svi_data["variables"][variable_name] = svi_value
+        address = "N/A"
+        if lat and lon:
+            geo_data = maps_client.reverse_geocode(lat, lon)
+            if geo_data and geo_data.get('results'):
+                address = geo_data['results'][0]['formatted_address']
+        event['nearest_address'] = address
 
-    return svi_data
+    return flood_events
 
 
 def get_timezone_display_name(timezone_id):
@@ -684,15 +761,15 @@ def get_precipitation_forecast(maps_client, lat, lon, hours, local_tz=None, time
         return []
 
 
-def get_contextual_data_for_locations(geocoded_locations, connection, maps_client, forecast_hours=None):
+def get_contextual_data_for_locations(geocoded_locations, pool, maps_client, forecast_hours=None):
     """
     Main orchestrator function. Takes a list of geocoded locations and
     enriches each with data from the local database.
-    """
-    enriched_data = []
-    first_county_name = None
 
-    for location in geocoded_locations:
+    Locations are processed concurrently; each worker borrows its own
+    connection from the pool. Results keep the order of geocoded_locations.
+    """
+    def _fetch_one(location):
         lat = location['latitude']
         lon = location['longitude']
         print(f"--- Fetching contextual data for: {location['name']} ({lat}, {lon}) ---", file=sys.stderr)
@@ -714,20 +791,18 @@ def get_contextual_data_for_locations(geocoded_locations, connection, maps_clien
         else:
             print("Could not retrieve timezone. Times will be shown in UTC.", file=sys.stderr)
 
-        county_info = get_county_info(connection, lat, lon)
+        db_context = get_all_context(pool, lat, lon, svi_year=2022)
 
-        if not county_info:
+        if not db_context:
             print(f"Location '{location['name']}' is not within a known county. Skipping.\n", file=sys.stderr)
-            enriched_data.append({
+            return {
                 "input_location": location,
                 "status": "No county found"
-            })
-            continue
+            }
 
+        county_info = db_context['county_data']
         fips_code = county_info['fips_code']
         print(f"Found County: {county_info['county_name']} ({fips_code})", file=sys.stderr)
-        if first_county_name is None:  # <-- ADD THIS
-            first_county_name = county_info['county_name']
 
         # Get precipitation forecast if requested
         precipitation_forecast = []
@@ -747,14 +822,24 @@ def get_contextual_data_for_locations(geocoded_locations, connection, maps_clien
             "timezone": timezone_id,
             "timezone_display_name": timezone_display_name,
             "county_data": county_info,
-            "precipitation_history": get_precipitation_history(connection, fips_code),
+            "precipitation_history": db_context['precipitation_history'],
             "precipitation_forecast": precipitation_forecast,
-            "flood_event_history": get_flood_history(connection, fips_code, maps_client, lat, lon),
-            "social_vulnerability_index": get_svi_data(connection, fips_code, release_year=2022)
+            "flood_event_history": get_flood_history(db_context['flood_event_history'], maps_client),
+            "social_vulnerability_index": db_context['social_vulnerability_index']
         }
 
-        enriched_data.append(location_context)
         print("Successfully fetched all data.\n", file=sys.stderr)
+        return location_context
+
+    with ThreadPoolExecutor(max_workers=max(1, min(8, len(geocoded_locations)))) as executor:
+        futures = [executor.submit(_fetch_one, location) for location in geocoded_locations]
+        # Collect in submission order to preserve the input ordering
+        enriched_data = [future.result() for future in futures]
+
+    first_county_name = next(
+        (item['county_data']['county_name'] for item in enriched_data if 'county_data' in item),
+        None
+    )
 
     return (
         enriched_data,
@@ -762,7 +847,219 @@ def get_contextual_data_for_locations(geocoded_locations, connection, maps_clien
     )
 
 
-def generate_llm_answer(user_query, filtered_context, openai_api_key, query_unit=None):
+def _dumps_pretty(obj):
+    """
+    Serializes an object to an indented JSON string using orjson. Keys are
+    sorted so the same data always produces byte-identical prompt text.
+    """
+    return orjson.dumps(obj, option=orjson.OPT_INDENT_2 | orjson.OPT_SORT_KEYS, default=str).decode()
+
+
+class HourlyRow(BaseModel):
+    """
+    One hour of a forecast as presented in the answer.
+    """
+    model_config = ConfigDict(extra='forbid')
+
+    time: str
+    temperature_fahrenheit: Optional[float]
+    temperature_celsius: Optional[float]
+    precipitation_probability: Optional[float]
+    precipitation_amount_in: Optional[float]
+    weather_condition: Optional[str]
+
+
+class DailyRow(BaseModel):
+    """
+    One day of a forecast summarized in the answer.
+    """
+    model_config = ConfigDict(extra='forbid')
+
+    date: str
+    temperature_min_fahrenheit: Optional[float]
+    temperature_max_fahrenheit: Optional[float]
+    precipitation_probability_min: Optional[float]
+    precipitation_probability_max: Optional[float]
+    precipitation_total_in: Optional[float]
+    summary: str
+
+
+class WeeklyRow(BaseModel):
+    """
+    A week-long forecast summary in the answer.
+    """
+    model_config = ConfigDict(extra='forbid')
+
+    week: str
+    temperature_min_fahrenheit: Optional[float]
+    temperature_max_fahrenheit: Optional[float]
+    precipitation_total_in: Optional[float]
+    summary: str
+
+
+class FloodAnswer(BaseModel):
+    """
+    Structured answer returned by generate_llm_answer. The narrative holds the
+    full Markdown answer shown to the user; the forecast rows carry the same
+    numbers in machine-readable form so consumers do not need to re-parse text.
+    The narrative is the first field so it is generated, and streamed, first.
+    """
+    model_config = ConfigDict(extra='forbid')
+
+    narrative: str
+    timezone: str
+    hourly: Optional[List[HourlyRow]]
+    daily: Optional[List[DailyRow]]
+    weekly: Optional[WeeklyRow]
+
+
+FLOOD_ANSWER_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "FloodAnswer",
+        "schema": FloodAnswer.model_json_schema(),
+        "strict": True
+    }
+}
+
+
+class _NarrativeStreamDecoder:
+    """
+    Incrementally decodes the "narrative" string from streamed fragments of a
+    FloodAnswer JSON response, so only readable answer text is forwarded.
+    Escape sequences split across fragments are held back until complete.
+    """
+    _PREFIX = re.compile(r'\s*\{\s*"narrative"\s*:\s*"')
+    _PLAIN = re.compile(r'[^"\\]+')
+    _ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+
+    def __init__(self):
+        self._buffer = ""
+        self._pos = None # Index of the next undecoded narrative character
+        self.done = False
+
+    def feed(self, fragment):
+        """Adds a fragment of the response and returns the newly decoded narrative text."""
+        if self.done:
+            return ""
+        self._buffer += fragment
+        if self._pos is None:
+            match = self._PREFIX.match(self._buffer)
+            if match is None:
+                return ""
+            self._pos = match.end()
+
+        decoded = []
+        buf, pos = self._buffer, self._pos
+        while pos < len(buf):
+            plain = self._PLAIN.match(buf, pos)
+            if plain:
+                decoded.append(plain.group())
+                pos = plain.end()
+                continue
+            if buf[pos] == '"':
+                self.done = True
+                break
+            # Backslash escape: wait for the rest of it if it is incomplete
+            if pos + 1 >= len(buf):
+                break
+            if buf[pos + 1] != 'u':
+                decoded.append(self._ESCAPES.get(buf[pos + 1], buf[pos + 1]))
+                pos += 2
+                continue
+            end = pos + 6
+            if end <= len(buf) and 0xD800 <= int(buf[pos + 2:end], 16) < 0xDC00:
+                end += 6 # High surrogate: decode it together with its low half
+            if end > len(buf):
+                break
+            decoded.append(orjson.loads(f'"{buf[pos:end]}"'))
+            pos = end
+        self._pos = pos
+        return "".join(decoded)
+
+
+# System prompt preamble shared by every answer-generation call. It must stay
+# byte-identical across calls (and above OpenAI's 1024-token threshold) so the
+# provider's automatic prompt-prefix caching can reuse it; anything that varies
+# per query (e.g. the forecast formatting block) is appended after it.
+_STABLE_PREAMBLE = """You are an expert flood information assistant. You have access to flood-related data including:
+- Precipitation forecasts and historical data with temperature information
+- Historical flood events with locations and dates
+- Social Vulnerability Index (SVI) data indicating community risk factors
+- County-level geographic information
+- Timezone information for each location
+
+Your task is to provide clear, accurate, and helpful answers based on the provided data.
+If the data doesn't contain enough information to fully answer the question, acknowledge what you can answer and what information is missing.
+Always cite specific data points when making claims.
+
+IMPORTANT: When providing information about a location, you MUST include the timezone information at the beginning of your answer.
+Format the timezone information as: "[Location] belongs to Timezone: [timezone_id] ([timezone_display_name])"
+Example: "Tuscaloosa belongs to Timezone: America/Chicago (Central Time)"
+This helps users understand the local time context for forecasts and events.
+
+When presenting individual data points, include temperature, precipitation, and weather condition information.
+Always include the weather condition (e.g., Clear, Cloudy, Rainy, Sunny) when available.
+
+GUIDANCE FOR INTERPRETING THE AVAILABLE DATA:
+
+Precipitation forecasts:
+- Each forecast entry covers one hour and is already converted to the location's local time.
+- "precipitation_probability" is a percentage (0-100). "precipitation_amount_in" and "precipitation_amount_mm" are the expected liquid amounts for that hour.
+- A high probability with a very small amount usually means light or intermittent rain; a moderate probability with a large amount signals a risk of heavy bursts.
+- When summarizing several hours or days, add up the hourly amounts to obtain totals and report probability as a range rather than an average.
+- Hourly totals above roughly 1 inch, or 24-hour totals above roughly 3 inches, can produce flash flooding in urban areas, low-lying roads, and small streams. Mention this risk when the forecast approaches those amounts, but do not invent warnings that the data does not support.
+
+Precipitation history:
+- Monthly totals are reported in inches for the county that contains the queried location.
+- Compare a month against the same month in other years, not against other months, since rainfall in Alabama is seasonal (typically wetter in winter and early spring, with tropical systems possible from June through November).
+- Point out unusually wet months, since saturated soils increase the likelihood that later rain will produce runoff and flooding.
+
+Historical flood events:
+- Each event has a type ("Flash Flood" or "Flood"), a begin date, a warning zone, coordinates, and a distance in miles from the queried point.
+- Flash floods develop within minutes to a few hours of intense rainfall and are most dangerous along creeks, underpasses, and poorly drained streets. River floods ("Flood") develop more slowly and can last for days along larger rivers.
+- Events are sorted nearest first. When discussing them, emphasize the closest and most recent events, give their distance and date, and mention the nearest address when one is available.
+- The absence of recorded events near a point does not mean the area cannot flood; say so when relevant.
+
+Social Vulnerability Index (SVI):
+- SVI rankings are percentiles between 0 and 1. Higher values indicate greater social vulnerability; values above 0.75 are generally considered high vulnerability.
+- The overall ranking is provided at both national and state level, and themes cover Socioeconomic Status, Household Characteristics, Racial & Ethnic Minority Status, and Housing Type & Transportation.
+- Use SVI to explain why a community may be more affected by flooding (for example, limited vehicle access makes evacuation harder, and mobile homes are more exposed to flood damage), and avoid language that stigmatizes residents.
+
+County information:
+- County data includes the county name, state, FIPS code, and area in square miles. Use it to anchor the answer geographically.
+
+General rules:
+- Never fabricate numbers, dates, or locations that do not appear in the data.
+- Keep units consistent: report precipitation in inches (with millimeters where helpful) and temperatures in Fahrenheit with Celsius in parentheses.
+- When multiple locations are present, answer for each location separately and clearly label which data belongs to which location.
+- For safety-related questions, remind users to follow official guidance from the National Weather Service and local emergency management, and never to drive through flooded roadways.
+
+Answer structure:
+- Start with the timezone statement, then give a short direct answer to the question in one or two sentences.
+- Follow with the supporting details, grouped by data type (forecast, precipitation history, flood events, vulnerability) and using Markdown headings or bullet lists.
+- Use bold text for dates, times, and key numbers so they are easy to scan.
+- End with a brief note on any data that was requested but is not available.
+
+Output format:
+- Respond with a JSON object matching the FloodAnswer schema.
+- "timezone" holds the timezone statement for the queried location(s).
+- "narrative" holds the complete Markdown answer shown to the user, including the timezone statement and following every formatting requirement below.
+- Fill "hourly", "daily", or "weekly" with the forecast figures that match the time scale the user asked for, and set the others to null. Set all three to null when no forecast is involved.
+"""
+
+
+# Fixed lead-in of the answer-generation user message
+_ANSWER_INSTRUCTIONS = """Please provide a comprehensive answer to the user's question (given at the end) based on the available data below.
+Structure your response clearly and include specific numbers, dates, and locations when relevant.
+
+IMPORTANT: Start your answer by stating the timezone information for the queried location(s) using the format:
+"[Location] belongs to Timezone: [timezone_id] ([timezone_display_name])"
+
+Then provide the detailed answer to the user's question following the formatting requirements specified in the system prompt."""
+
+
+def generate_llm_answer(user_query, filtered_context, openai_api_key, query_unit=None, on_token=None):
     """
     Generates a natural language answer using GPT-4o based on the filtered context.
 
@@ -771,15 +1068,17 @@ def generate_llm_answer(user_query, filtered_context, openai_api_key, query_unit
         filtered_context: The filtered contextual data from select_relevant_context()
         openai_api_key: OpenAI API key
         query_unit: The time unit used in the user's query ('hours', 'days', or 'weeks')
+        on_token: Optional callable; when given, the response is streamed and each
+            decoded fragment of the narrative is passed to it as it arrives
 
     Returns:
-        String containing the LLM's answer
+        FloodAnswer with the narrative answer and structured forecast rows
     """
     try:
-        client = openai.OpenAI(api_key=openai_api_key)
+        client = get_openai_client(openai_api_key)
 
         # Prepare the context as a formatted string
-        context_str = json.dumps(filtered_context['filtered_data'], indent=2)
+        context_str = _dumps_pretty(filtered_context['filtered_data'])
 
         # Build formatting instructions based on query_unit
         if query_unit == 'hours':
@@ -824,60 +1123,83 @@ Provide a WEEKLY OVERVIEW with general trends and totals."""
 When presenting precipitation forecasts, format them appropriately based on the time scale requested.
 Always include both precipitation probability AND precipitation amount (in inches)."""
 
-        system_prompt = f"""You are an expert flood information assistant. You have access to flood-related data including:
-- Precipitation forecasts and historical data with temperature information
-- Historical flood events with locations and dates
-- Social Vulnerability Index (SVI) data indicating community risk factors
-- County-level geographic information
-- Timezone information for each location
-
-Your task is to provide clear, accurate, and helpful answers based on the provided data.
-If the data doesn't contain enough information to fully answer the question, acknowledge what you can answer and what information is missing.
-Always cite specific data points when making claims.
+        system_prompt = f"{_STABLE_PREAMBLE}\n{forecast_format_instruction}"
 
-IMPORTANT: When providing information about a location, you MUST include the timezone information at the beginning of your answer.
-Format the timezone information as: "[Location] belongs to Timezone: [timezone_id] ([timezone_display_name])"
-Example: "Tuscaloosa belongs to Timezone: America/Chicago (Central Time)"
-This helps users understand the local time context for forecasts and events.
-
-{forecast_format_instruction}
-
-When presenting individual data points, include temperature, precipitation, and weather condition information.
-Always include the weather condition (e.g., Clear, Cloudy, Rainy, Sunny) when available."""
-
-        user_prompt = f"""User Question: {user_query}
+        # Static instructions first, then the data, then the question, so the
+        # per-query parts of the prompt come last
+        user_prompt = f"""{_ANSWER_INSTRUCTIONS}
 
 Available Data:
 {context_str}
 
-Please provide a comprehensive answer to the user's question based on the available data above.
-Structure your response clearly and include specific numbers, dates, and locations when relevant.
-
-IMPORTANT: Start your answer by stating the timezone information for the queried location(s) using the format:
-"[Location] belongs to Timezone: [timezone_id] ([timezone_display_name])"
-
-Then provide the detailed answer to the user's question following the formatting requirements specified in the system prompt."""
-
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            temperature=0.1,
-        )
+User Question: {user_query}"""
+
+        # Identical questions over identical data reuse the previous answer
+        prompt_digest = hashlib.sha1((system_prompt + context_str).encode()).hexdigest()
+        cache_key = ('generate_llm_answer', normalize_query(user_query), prompt_digest)
+        cached = get_cache('llm').get(cache_key)
+        if cached is not None:
+            answer = FloodAnswer.model_validate_json(cached)
+            if on_token:
+                on_token(answer.narrative)
+            return answer
+
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ]
+
+        if on_token:
+            stream = client.chat.completions.create(
+                model=ANSWER_MODEL,
+                messages=messages,
+                temperature=0.1,
+                response_format=FLOOD_ANSWER_RESPONSE_FORMAT,
+                stream=True,
+            )
+            # Only the decoded narrative is forwarded, never the JSON around it
+            decoder = _NarrativeStreamDecoder()
+            streamed = False
+            parts = []
+            for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    parts.append(delta)
+                    text = decoder.feed(delta)
+                    if text:
+                        on_token(text)
+                        streamed = True
+            content = "".join(parts)
+        else:
+            response = client.chat.completions.create(
+                model=ANSWER_MODEL,
+                messages=messages,
+                temperature=0.1,
+                response_format=FLOOD_ANSWER_RESPONSE_FORMAT,
+            )
+            content = response.choices[0].message.content
 
-        return response.choices[0].message.content
+        answer = FloodAnswer.model_validate_json(content)
+        if on_token and not streamed:
+            # The narrative did not lead the response; send it whole instead
+            on_token(answer.narrative)
+        get_cache('llm').set(cache_key, content, expire=LLM_CACHE_TTL)
+        return answer
 
     except Exception as e:
         print(f"Error generating LLM answer: {e}", file=sys.stderr)
         return None
 
 
-def main_script_logic(user_query):
+def main_script_logic(user_query, on_token=None):
     """
     Main end-to-end pipeline function.
 
+    If on_token is given, the answer is streamed to it while it is generated
+    (see generate_llm_answer).
+
     Pipeline stages:
     1. Retrieve full flood context data from database
     2. Intelligently filter relevant information
@@ -900,9 +1222,11 @@ def main_script_logic(user_query):
         print(f"Error: {e}", file=sys.stderr)
         return None
 
-    # Connect to database
+    # Create a small connection pool so locations can be queried concurrently
     try:
-        conn = psycopg2.connect(
+        pool = PreparedConnectionPool(
+            minconn=1,
+            maxconn=8,
             host=PG_HOST,
             database=PG_DB,
             user=PG_USER,
@@ -917,9 +1241,11 @@ def main_script_logic(user_query):
         print("STAGE 1: RETRIEVING FLOOD CONTEXT DATA", file=sys.stderr)
         print("="*70, file=sys.stderr)
 
-        # Step 1: Check if user is requesting precipitation forecast
-        print("\n[1.1] Analyzing query for precipitation forecast request...", file=sys.stderr)
-        forecast_request = extract_precipitation_time_request(user_query, OPENAI_API_KEY)
+        # Step 1: Extract locations and any precipitation forecast request in one call
+        print(f"Processing user query: '{user_query}'\n", file=sys.stderr)
+        print("\n[1.1] Analyzing query for locations and precipitation forecast request...", file=sys.stderr)
+        query_intent = extract_query_intent(user_query, OPENAI_API_KEY)
+        forecast_request = query_intent['forecast'] if query_intent else None
 
         if forecast_request:
             forecast_hours = forecast_request['hours']
@@ -930,9 +1256,10 @@ def main_script_logic(user_query):
             query_unit = None
             print("✓ No precipitation forecast requested.\n", file=sys.stderr)
 
-        # Step 2: Extract coordinates from user query
-        print("[1.2] Extracting locations from query...", file=sys.stderr)
-        geocoded_results = extract_coordinates(user_query, maps_client, OPENAI_API_KEY)
+        # Step 2: Geocode the extracted locations
+        print("[1.2] Geocoding locations from query...", file=sys.stderr)
+        location_names = query_intent['locations'] if query_intent else []
+        geocoded_results = extract_coordinates(location_names, maps_client)
 
         if not geocoded_results:
             print("✗ Could not extract locations from query.", file=sys.stderr)
@@ -942,7 +1269,7 @@ def main_script_logic(user_query):
         print("\n[1.3] Retrieving contextual data from database...", file=sys.stderr)
         retrieval_results, county_name = get_contextual_data_for_locations(
             geocoded_results,
-            conn,
+            pool,
             maps_client,
             forecast_hours=forecast_hours
         )
@@ -958,10 +1285,13 @@ def main_script_logic(user_query):
         print("STAGE 2: FILTERING RELEVANT INFORMATION", file=sys.stderr)
         print("="*70, file=sys.stderr)
 
+        # Common queries are classified by keyword rules; others fall back to OpenAI
+        intent = rule_based_intent(user_query, forecast_requested=forecast_request is not None)
         filtered_context = select_relevant_context(
             retrieval_results,
             user_query,
-            OPENAI_API_KEY
+            OPENAI_API_KEY,
+            intent=intent
         )
 
         # Step 5: Generate final answer using LLM
@@ -970,7 +1300,9 @@ def main_script_logic(user_query):
         print("="*70, file=sys.stderr)
         print("\n[3.1] Generating natural language answer using GPT-4o...", file=sys.stderr)
 
-        final_answer = generate_llm_answer(user_query, filtered_context, OPENAI_API_KEY, query_unit=query_unit)
+        final_answer = generate_llm_answer(
+            user_query, filtered_context, OPENAI_API_KEY, query_unit=query_unit, on_token=on_token
+        )
 
         if not final_answer:
             print("✗ Failed to generate answer.", file=sys.stderr)
@@ -980,40 +1312,90 @@ def main_script_logic(user_query):
 
         return {
             "query": user_query,
-            "answer": final_answer,
+            "answer": final_answer.narrative,
+            "structured_answer": final_answer.model_dump(),
             "filtered_context": filtered_context,
             "full_retrieval_data": retrieval_results,
             "county_name": county_name
         }
 
     finally:
-        # Close database connection
-        if conn:
-            conn.close()
+        # Close database connections
+        if pool:
+            pool.closeall()
             print("\n" + "="*70, file=sys.stderr)
-            print("Database connection closed.", file=sys.stderr)
+            print("Database connections closed.", file=sys.stderr)
             print("="*70, file=sys.stderr)
 
 
+def write_result_json(result, out):
+    """
+    Writes the pipeline result to a binary stream as one JSON document.
+
+    Top-level keys, and each record of 'full_retrieval_data', are encoded and
+    written one at a time so the complete serialized document is never held
+    in memory alongside the result itself.
+    """
+    if result is None:
+        out.write(b"null\n")
+        out.flush()
+        return
+
+    out.write(b"{")
+    for i, (key, value) in enumerate(result.items()):
+        if i:
+            out.write(b",")
+        out.write(orjson.dumps(key))
+        out.write(b":")
+        if key == "full_retrieval_data" and isinstance(value, list):
+            out.write(b"[")
+            for j, record in enumerate(value):
+                if j:
+                    out.write(b",")
+                out.write(orjson.dumps(record, default=str))
+            out.write(b"]")
+        else:
+            out.write(orjson.dumps(value, default=str))
+    out.write(b"}\n")
+    out.flush()
+
+
+def write_stream_event(out, event):
+    """Writes one JSON object on its own line and flushes it immediately."""
+    out.write(orjson.dumps(event, default=str))
+    out.write(b"\n")
+    out.flush()
+
+
 if __name__ == "__main__":
     user_query = ""
     try:
         # 1. Read query from stdin
         user_query = sys.stdin.read().strip()
         if not user_query:
-            print(json.dumps({"error": "Query cannot be empty."}), file=sys.stdout)
+            write_stream_event(sys.stdout.buffer, {"error": "Query cannot be empty."})
             sys.exit(1)
 
-        # 2. Call your main function
-        result = main_script_logic(user_query)
+        # 2. Call your main function. With --stream, answer tokens are emitted
+        # as newline-delimited JSON events as soon as they arrive, followed by
+        # a final "done" event carrying the full result.
+        if "--stream" in sys.argv[1:]:
+            out = sys.stdout.buffer
+            result = main_script_logic(
+                user_query,
+                on_token=lambda token: write_stream_event(out, {"type": "token", "data": token})
+            )
+            write_stream_event(out, {"type": "done", "result": result})
+        else:
+            result = main_script_logic(user_query)
 
-        # 3. Print the *full result* as JSON to stdout
-        print(json.dumps(result, ensure_ascii=False, default=str), file=sys.stdout)
+            # 3. Stream the *full result* as JSON to stdout
+            write_result_json(result, sys.stdout.buffer)
 
     except Exception as e:
         # 4. Print any errors as JSON to stdout
         error_message = f"Failed to process query '{user_query}': {type(e).__name__} - {str(e)}"
-        print(json.dumps({"error": error_message}), file=sys.stdout)
+        write_stream_event(sys.stdout.buffer, {"error": error_message})
 
         # 5. Log the full traceback to stderr
         print(f"\n--- Traceback for Error ({type(e).__name__}) ---", file=sys.stderr)
@@ -1,132 +1,179 @@
+import csv
+import io
 import psycopg2
+from psycopg2.extras import execute_values
 import rdflib
-from rdflib import Graph, RDFS, OWL, RDF, URIRef
-from rdflib.term import BNode
+from rdflib import Graph
 
-def populate_database(ttl_file_path, db_config):
+SPARQL_PREFIXES = """
+PREFIX owl: <http://www.w3.org/2002/07/owl#>
+PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
+"""
+
+# Named classes with their optional label/comment (blank-node restrictions are skipped)
+CLASSES_QUERY = SPARQL_PREFIXES + """
+SELECT ?s ?label ?comment WHERE {
+    ?s a owl:Class .
+    OPTIONAL { ?s rdfs:label ?label }
+    OPTIONAL { ?s rdfs:comment ?comment }
+    FILTER(!isBlank(?s))
+}
+"""
+
+# Named object/datatype properties with their optional label/comment
+PROPERTIES_QUERY = SPARQL_PREFIXES + """
+SELECT ?s ?label ?comment ?type WHERE {
+    VALUES ?type { owl:ObjectProperty owl:DatatypeProperty }
+    ?s a ?type .
+    OPTIONAL { ?s rdfs:label ?label }
+    OPTIONAL { ?s rdfs:comment ?comment }
+    FILTER(!isBlank(?s))
+}
+"""
+
+HIERARCHY_QUERY = SPARQL_PREFIXES + "SELECT ?sub ?super WHERE { ?sub rdfs:subClassOf ?super }"
+DOMAINS_QUERY = SPARQL_PREFIXES + "SELECT ?prop ?domain WHERE { ?prop rdfs:domain ?domain }"
+RANGES_QUERY = SPARQL_PREFIXES + "SELECT ?prop ?range WHERE { ?prop rdfs:range ?range }"
+
+
+def _optional_str(term):
+    """Converts an optional RDF term from a query row to a string or None."""
+    return str(term) if term else None
+
+
+def create_graph():
     """
-    Parses the TTL file and populates the structured PostgreSQL database.
+    Returns an empty Graph and the Turtle parser format to load it with: the
+    Rust Oxigraph store and its own "ox-turtle" parser when oxrdflib is
+    installed (much faster parsing of large ontologies), else the default
+    store and rdflib's Python "ttl" parser.
     """
-    # 1. Connect and Parse
     try:
-        conn = psycopg2.connect(**db_config)
-        cur = conn.cursor()
-        print("Database connection established.")
-    except psycopg2.Error as e:
-        print(f"Database connection error: {e}")
+        return Graph(store="Oxigraph"), "ox-turtle"
+    except rdflib.plugin.PluginException:
+        print("oxrdflib not installed; using the default rdflib store.")
+        return Graph(), "ttl"
+
+
+def copy_pairs(cur, insert_sql, rows):
+    """
+    Bulk loads (id, id) pairs with COPY into a temporary staging table, then
+    moves them into the target table with insert_sql, which must select
+    left_id, right_id FROM tmp_pairs.
+    """
+    if not rows:
         return
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+    # On error the caller rolls back, which also discards the temporary table
+    cur.execute("CREATE TEMP TABLE tmp_pairs (left_id INT, right_id INT);")
+    cur.copy_expert("COPY tmp_pairs (left_id, right_id) FROM STDIN WITH CSV", buffer)
+    cur.execute(insert_sql)
+    cur.execute("DROP TABLE tmp_pairs;")
 
-    g = Graph()
+
+def populate_database(ttl_file_path, db_config):
+    """
+    Parses the TTL file and populates the structured PostgreSQL database.
+    """
+    # 1. Parse, then connect, so no connection is held open while parsing
+    g, ttl_format = create_graph()
     try:
-        g.parse(ttl_file_path, format="ttl")
+        g.parse(ttl_file_path, format=ttl_format)
         print(f"TTL file parsed. Triples found: {len(g)}")
     except Exception as e:
         print(f"Error parsing TTL file: {e}")
         return
 
-    # Helper function to safely extract label and comment
-    def get_details(subject):
-        label = g.value(subject, RDFS.label)
-        comment = g.value(subject, RDFS.comment)
-        return (str(label) if label else None, str(comment) if comment else None)
+    try:
+        conn = psycopg2.connect(**db_config)
+        cur = conn.cursor()
+        print("Database connection established.")
+    except psycopg2.Error as e:
+        print(f"Database connection error: {e}")
+        return
 
     # 2. Insert Classes
     class_uri_to_id = {}
     print("Inserting classes...")
-    classes_to_process = []
-    
-    # Identify classes, skipping blank nodes (e.g., complex restrictions)
-    for s in g.subjects(RDF.type, OWL.Class):
-        if isinstance(s, BNode): continue
-        uri = str(s)
-        label, comment = get_details(s)
-        classes_to_process.append((uri, label, comment))
-
-    # Insert classes and retrieve their generated IDs
-    for uri, label, comment in classes_to_process:
-        try:
-            cur.execute(
-                "INSERT INTO classes (uri, label, comment) VALUES (%s, %s, %s) "
-                "ON CONFLICT (uri) DO UPDATE SET label = EXCLUDED.label, comment = EXCLUDED.comment "
-                "RETURNING id;",
-                (uri, label, comment)
-            )
-            class_id = cur.fetchone()[0]
-            class_uri_to_id[uri] = class_id
-        except psycopg2.Error as e:
-            conn.rollback() # Rollback on error
-            print(f"Error inserting class {uri}: {e}")
-            
-    conn.commit() # Commit after the stage is complete
+
+    # Identify classes in one query; keep the first label/comment seen per URI
+    classes_by_uri = {}
+    for s, label, comment in g.query(CLASSES_QUERY):
+        classes_by_uri.setdefault(str(s), (str(s), _optional_str(label), _optional_str(comment)))
+    classes_to_process = list(classes_by_uri.values())
+
+    # Insert all classes, then read their IDs back with a single lookup
+    try:
+        execute_values(
+            cur,
+            "INSERT INTO classes (uri, label, comment) VALUES %s "
+            "ON CONFLICT (uri) DO UPDATE SET label = EXCLUDED.label, comment = EXCLUDED.comment;",
+            classes_to_process,
+            page_size=500
+        )
+        cur.execute("SELECT id, uri FROM classes WHERE uri = ANY(%s);", (list(classes_by_uri),))
+        class_uri_to_id = {uri: class_id for class_id, uri in cur.fetchall()}
+        conn.commit() # Commit after the stage is complete
+    except psycopg2.Error as e:
+        conn.rollback() # Rollback on error
+        print(f"Error inserting classes: {e}")
 
     # 3. Insert Properties
     property_uri_to_id = {}
-    property_types = {
-        OWL.ObjectProperty: "ObjectProperty",
-        OWL.DatatypeProperty: "DatatypeProperty",
-    }
     print("Inserting properties...")
-    properties_to_process = []
-    
-    # Identify properties
-    for prop_type_uri, prop_type_name in property_types.items():
-        for s in g.subjects(RDF.type, prop_type_uri):
-            if isinstance(s, BNode): continue
-            uri = str(s)
-            label, comment = get_details(s)
-            properties_to_process.append((uri, label, comment, prop_type_name))
-
-    # Insert properties and retrieve their generated IDs
-    for uri, label, comment, prop_type_name in properties_to_process:
-        try:
-            cur.execute(
-                "INSERT INTO properties (uri, label, comment, type) VALUES (%s, %s, %s, %s) "
-                "ON CONFLICT (uri) DO UPDATE SET label = EXCLUDED.label, comment = EXCLUDED.comment, type = EXCLUDED.type "
-                "RETURNING id;",
-                (uri, label, comment, prop_type_name)
-            )
-            prop_id = cur.fetchone()[0]
-            property_uri_to_id[uri] = prop_id
-        except psycopg2.Error as e:
-            conn.rollback()
-            print(f"Error inserting property {uri}: {e}")
-            
-    conn.commit()
+
+    # Identify properties in one query. A single INSERT cannot update the same
+    # row twice, so keep one entry per URI.
+    properties_by_uri = {}
+    for s, label, comment, prop_type in g.query(PROPERTIES_QUERY):
+        prop_type_name = str(prop_type).rsplit('#', 1)[-1] # e.g. "ObjectProperty"
+        properties_by_uri.setdefault(
+            str(s), (str(s), _optional_str(label), _optional_str(comment), prop_type_name)
+        )
+    properties_to_process = list(properties_by_uri.values())
+
+    # Insert all properties, then read their IDs back with a single lookup
+    try:
+        execute_values(
+            cur,
+            "INSERT INTO properties (uri, label, comment, type) VALUES %s "
+            "ON CONFLICT (uri) DO UPDATE SET label = EXCLUDED.label, comment = EXCLUDED.comment, type = EXCLUDED.type;",
+            properties_to_process,
+            page_size=500
+        )
+        cur.execute("SELECT id, uri FROM properties WHERE uri = ANY(%s);", (list(properties_by_uri),))
+        property_uri_to_id = {uri: prop_id for prop_id, uri in cur.fetchall()}
+        conn.commit()
+    except psycopg2.Error as e:
+        conn.rollback()
+        print(f"Error inserting properties: {e}")
 
     # 4. Insert Relationships (Hierarchy, Domains, Ranges)
     print("Inserting relationships...")
     
+    def resolve_pairs(query, left_ids, right_ids):
+        """Runs a two-column SPARQL query and maps both URIs to imported IDs."""
+        pairs = []
+        for left, right in g.query(query):
+            left_id = left_ids.get(str(left))
+            right_id = right_ids.get(str(right))
+            # Ensure both ends are named terms we imported
+            if left_id and right_id:
+                pairs.append((left_id, right_id))
+        return pairs
+
     # Prepare data for bulk insertion
-    hierarchy_data = []
-    for s, o in g.subject_objects(RDFS.subClassOf):
-        sub_id = class_uri_to_id.get(str(s))
-        super_id = class_uri_to_id.get(str(o))
-        # Ensure both are defined, named classes we imported
-        if sub_id and super_id:
-            hierarchy_data.append((sub_id, super_id))
-    
-    domain_data = []
-    range_data = []
-    for prop_uri, prop_id in property_uri_to_id.items():
-        prop_ref = URIRef(prop_uri)
-        
-        # Domains (rdfs:domain) - Robustly iterate over all defined domains
-        for domain in g.objects(prop_ref, RDFS.domain):
-            domain_id = class_uri_to_id.get(str(domain))
-            if domain_id:
-                domain_data.append((prop_id, domain_id))
-
-        # Ranges (rdfs:range) - Robustly iterate over all defined ranges
-        for range_obj in g.objects(prop_ref, RDFS.range):
-            range_id = class_uri_to_id.get(str(range_obj)) # Look up the ID
-            if range_id: # Only add if the range is a known class
-                range_data.append((prop_id, range_id))
-
-    # Use executemany for efficient bulk insertion
+    hierarchy_data = resolve_pairs(HIERARCHY_QUERY, class_uri_to_id, class_uri_to_id)
+    domain_data = resolve_pairs(DOMAINS_QUERY, property_uri_to_id, class_uri_to_id)
+    range_data = resolve_pairs(RANGES_QUERY, property_uri_to_id, class_uri_to_id)
+
+    # Stage each relation with COPY, then insert with a single INSERT ... SELECT
     try:
-        cur.executemany("INSERT INTO class_hierarchy (subclass_id, superclass_id) VALUES (%s, %s) ON CONFLICT DO NOTHING;", hierarchy_data)
-        cur.executemany("INSERT INTO property_domains (property_id, domain_class_id) VALUES (%s, %s) ON CONFLICT DO NOTHING;", domain_data)
-        cur.executemany("INSERT INTO property_ranges (property_id, range_class_id) VALUES (%s, %s) ON CONFLICT DO NOTHING;", range_data)
+        copy_pairs(cur, "INSERT INTO class_hierarchy (subclass_id, superclass_id) SELECT left_id, right_id FROM tmp_pairs ON CONFLICT DO NOTHING;", hierarchy_data)
+        copy_pairs(cur, "INSERT INTO property_domains (property_id, domain_class_id) SELECT left_id, right_id FROM tmp_pairs ON CONFLICT DO NOTHING;", domain_data)
+        copy_pairs(cur, "INSERT INTO property_ranges (property_id, range_class_id) SELECT left_id, right_id FROM tmp_pairs ON CONFLICT DO NOTHING;", range_data)
         conn.commit()
     except psycopg2.Error as e:
         conn.rollback()
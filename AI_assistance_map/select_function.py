@@ -6,33 +6,202 @@ This script analyzes user queries and selectively extracts only relevant informa
 from the flood context retrieval results, preparing focused data for LLM processing.
 """
 
-import json
+import orjson
 import os
+import re
+import heapq
+import hashlib
+import base64
+import functools
+import diskcache
 import numpy as np
 from dotenv import load_dotenv
 import openai
-from typing import Dict, List, Any
+import httpx
+from typing import Dict, List, Any, Iterable, Iterator, Optional
+from pydantic import BaseModel, ConfigDict, ValidationError
 import sys # Import sys for stderr
-import traceback # For detailed error logging
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
-# Load SVI description for better semantic understanding
-def load_svi_context():
-    """Load the SVI description file for semantic understanding of variables."""
-    try:
-        # Assuming prompts/ is relative to this script's location
-        script_dir = os.path.dirname(os.path.abspath(__file__))
-        svi_file_path = os.path.join(script_dir, 'prompts', 'social_vulnerability_index.txt')
-        with open(svi_file_path, 'r') as f:
-            return f.read()
-    except FileNotFoundError:
-        print("Warning: SVI context file not found at prompts/social_vulnerability_index.txt. Using basic understanding.", file=sys.stderr)
-        return ""
-    except Exception as e:
-        print(f"Error loading SVI context: {e}", file=sys.stderr)
-        return ""
+try:
+    import simsimd # Optional SIMD similarity kernels
+except ImportError:
+    simsimd = None
+
+try:
+    import h2 # Optional; enables HTTP/2 in the OpenAI client
+except ImportError:
+    h2 = None
+
+try:
+    import ijson # Optional incremental JSON parsing for main_test
+except ImportError:
+    ijson = None
+
+# Per-location diagnostics go through logging so they cost nothing unless enabled
+log = logging.getLogger(__name__)
+
+# Persistent caches live under CACHE_DIR, one diskcache directory per name:
+#   'embeddings'     - embeddings of SVI variable texts and queries, keyed by a hash of the model and text
+#   'intents'        - semantic cache of analyzed intents, keyed by ('intent', normalized query),
+#                      plus one embedding index for reusing intents of nearly identical queries
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache')
+
+
+@functools.lru_cache(maxsize=None)
+def get_cache(name: str) -> diskcache.Cache:
+    """
+    Opens the named on-disk cache on first use and shares it afterwards,
+    so importing this module does no filesystem work.
+    """
+    return diskcache.Cache(os.path.join(CACHE_DIR, name))
+
+
+EMBEDDING_MODEL = "text-embedding-3-large"
+INTENT_CACHE_TTL = 86400 * 7
+INTENT_SIMILARITY_THRESHOLD = 0.95
+INTENT_INDEX_MAX_ENTRIES = 1000 # Most recent queries kept in the embedding index
+_INTENT_INDEX_KEY = 'embedding_index'
+_intent_memo: Dict[str, Dict[str, Any]] = {} # In-process layer in front of the 'intents' cache
 
+# Keyword rules that classify common queries without an OpenAI round-trip
+_FORECAST_PATTERN = re.compile(r"\b(forecast\w*|will\s+(it\s+)?(rain|flood|storm)|future|tomorrow|tonight|upcoming|next\s+(\d+\s+)?(hours?|days?|weeks?|week\s*end))\b", re.IGNORECASE)
+_HISTORY_PATTERN = re.compile(r"\b(history|historical|historically|past|previous(ly)?|ever|before|flooded|happened|recent(ly)?|last\s+\w*\s*(years?|decades?))\b", re.IGNORECASE)
+_RECENT_PATTERN = re.compile(r"\b(recent(ly)?|lately|last\s+(few\s+|\d+\s+)?(years?|months?))\b", re.IGNORECASE)
+_SVI_PATTERN = re.compile(r"\b(why|vulnerab\w*|svi|demographic\w*|poverty|income|social\w*|minority|disabilit\w*|elderly)\b", re.IGNORECASE)
+RECENT_YEARS = 5
 
-SVI_CONTEXT = load_svi_context()
+# Default minimum cosine similarity between the query and an SVI variable, both
+# grounded in the SVI context (see _embed_with_svi_context)
+SVI_RELEVANCE_THRESHOLD = 0.3
+
+
+def rule_based_intent(query: str, forecast_requested: Optional[bool] = None):
+    """
+    Classifies the query with keyword rules.
+    forecast_requested, when known (e.g. from an earlier extraction step),
+    overrides the forecast keyword rule.
+    Returns an intent in the same format as analyze_query_intent, or None when
+    the rules do not recognise the query and the OpenAI analysis is needed.
+    """
+    if forecast_requested is None:
+        forecast_requested = bool(_FORECAST_PATTERN.search(query))
+    needs_history = bool(_HISTORY_PATTERN.search(query))
+    if not (forecast_requested or needs_history):
+        return None
+    recent = bool(_RECENT_PATTERN.search(query))
+
+    return {
+        "needs_precipitation_forecast": forecast_requested, "needs_precipitation_history": needs_history,
+        "recent_precipitation_only": recent,
+        "needs_flood_history": needs_history, "needs_svi_data": bool(_SVI_PATTERN.search(query)), "needs_county_info": True,
+        "flood_event_filters": {"max_events": 10, "max_distance_miles": None, "recent_only": recent},
+        "svi_relevance_threshold": SVI_RELEVANCE_THRESHOLD
+    }
+
+
+@functools.lru_cache(maxsize=4)
+def get_openai_client(openai_api_key: str) -> openai.OpenAI:
+    """
+    Returns a shared OpenAI client per key so its HTTP connections are reused
+    across calls and threads; multiplexed over HTTP/2 when h2 is installed.
+    """
+    http_client = httpx.Client(
+        http2=h2 is not None,
+        limits=httpx.Limits(max_connections=20, max_keepalive_connections=10)
+    )
+    return openai.OpenAI(api_key=openai_api_key, http_client=http_client)
+
+
+def _similar_cached_intent(query_embedding):
+    """
+    Returns the cached intent of the most similar earlier query above the threshold, or None.
+    Reads only the embedding index (one float16 matrix), not every cached entry.
+    """
+    cache = get_cache('intents')
+    index = cache.get(_INTENT_INDEX_KEY)
+    if index is None:
+        return None
+    queries, matrix = index
+    if len(queries) == 0 or matrix.shape[1] != len(query_embedding):
+        return None
+    similarities = _query_similarities(query_embedding, matrix)
+    best = int(np.argmax(similarities))
+    if similarities[best] < INTENT_SIMILARITY_THRESHOLD:
+        return None
+    return cache.get(('intent', queries[best])) # None if that entry has expired
+
+
+def _store_intent(normalized_query: str, query_embedding, intent: Dict[str, Any]):
+    """
+    Caches the intent and appends the query's embedding to the embedding index,
+    keeping the INTENT_INDEX_MAX_ENTRIES most recent queries.
+    """
+    cache = get_cache('intents')
+    embedding = np.asarray(query_embedding, dtype=np.float16)
+    with cache.transact():
+        cache.set(('intent', normalized_query), intent, expire=INTENT_CACHE_TTL)
+        queries, matrix = cache.get(_INTENT_INDEX_KEY, default=([], None))
+        if matrix is None or matrix.shape[1] != len(embedding):
+            queries, matrix = [], np.empty((0, len(embedding)), dtype=np.float16)
+        keep = [i for i, cached_query in enumerate(queries) if cached_query != normalized_query]
+        queries = [queries[i] for i in keep] + [normalized_query]
+        matrix = np.vstack([matrix[keep], embedding[None, :]])
+        cache.set(_INTENT_INDEX_KEY, (queries[-INTENT_INDEX_MAX_ENTRIES:], matrix[-INTENT_INDEX_MAX_ENTRIES:]))
+
+
+class FloodEventFilters(BaseModel):
+    """
+    Flood event filters chosen by the intent analysis.
+    """
+    model_config = ConfigDict(extra='forbid')
+
+    max_events: Optional[int]
+    max_distance_miles: Optional[float]
+    recent_only: bool
+
+
+class QueryIntent(BaseModel):
+    """
+    Data requirements of a query, as returned by analyze_query_intent.
+    """
+    model_config = ConfigDict(extra='forbid')
+
+    needs_precipitation_forecast: bool
+    needs_precipitation_history: bool
+    recent_precipitation_only: bool # Precipitation history limited to the last RECENT_YEARS years
+    needs_flood_history: bool
+    needs_svi_data: bool
+    needs_county_info: bool
+    flood_event_filters: FloodEventFilters
+    svi_relevance_threshold: float
+
+
+# Intent analysis is a small classification task; strict structured output
+# guarantees the response matches QueryIntent
+INTENT_MODEL = "gpt-4o-mini"
+QUERY_INTENT_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "QueryIntent",
+        "schema": QueryIntent.model_json_schema(),
+        "strict": True
+    }
+}
+
+# Static instructions go in the system message, identical on every call, with
+# the query alone as the user message; the schema already fixes the output keys
+INTENT_SYSTEM_PROMPT = (
+    "You analyze flood-related queries to determine what information is needed. "
+    "Data types available: precipitation forecast, precipitation history, flood event history, "
+    "Social Vulnerability Index (SVI), county info. SVI themes: Socioeconomic Status, Household "
+    "Characteristics, Racial & Ethnic Minority Status, Housing Type & Transportation. "
+    "Need SVI for \"why\"/\"vulnerability\"/\"demographics\". Need forecast for future rain. "
+    "Need history for past floods. Set recent_precipitation_only when only recent rainfall matters. "
+    "Use stricter filters for specific questions."
+)
 
 
 def analyze_query_intent(query: str, openai_api_key: str) -> Dict[str, Any]:
@@ -42,83 +211,334 @@ def analyze_query_intent(query: str, openai_api_key: str) -> Dict[str, Any]:
     """
     default_intent = {
             "needs_precipitation_forecast": True, "needs_precipitation_history": True,
-            "needs_flood_history": True, "needs_svi_data": True, "needs_county_info": True,
+            "recent_precipitation_only": False, "needs_flood_history": True, "needs_svi_data": True, "needs_county_info": True,
             "flood_event_filters": {"max_events": 10, "max_distance_miles": None, "recent_only": False},
-            "svi_relevance_threshold": 0.3
+            "svi_relevance_threshold": SVI_RELEVANCE_THRESHOLD
         }
+    # Obvious queries are classified by keyword without any API call
+    fast_intent = rule_based_intent(query)
+    if fast_intent is not None:
+        print("Using keyword-based intent.", file=sys.stderr)
+        return fast_intent
+
     content = None # Initialize
     try:
         if not openai_api_key: raise ValueError("OpenAI API Key missing for intent analysis.")
 
-        client = openai.OpenAI(api_key=openai_api_key)
-        prompt = f"""
-        You are an expert at analyzing flood-related queries to determine what information is needed.
-
-        Context: Data types available: Precipitation forecast, Precipitation history, Flood event history, Social Vulnerability Index (SVI), County info.
-        SVI Themes: Socioeconomic Status, Household Characteristics, Racial & Ethnic Minority Status, Housing Type & Transportation.
-
-        Analyze this query: "{query}"
-
-        Return JSON: {{"needs_precipitation_forecast": boolean, "needs_precipitation_history": boolean, "needs_flood_history": boolean, "needs_svi_data": boolean, "needs_county_info": boolean, "flood_event_filters": {{"max_events": integer_or_null, "max_distance_miles": float_or_null, "recent_only": boolean}}, "svi_relevance_threshold": float}}
-
-        Guidelines: Need SVI for "why"/"vulnerability"/"demographics". Need forecast for future rain. Need history for past floods. Use stricter filters for specific questions.
-
-        """
-
+        normalized_query = " ".join(query.lower().split())
+        if normalized_query in _intent_memo:
+            return _intent_memo[normalized_query]
+        cached = get_cache('intents').get(('intent', normalized_query))
+        if cached is not None:
+            print("Using cached intent for identical query.", file=sys.stderr)
+            _intent_memo[normalized_query] = cached
+            return cached
+
+        query_embeddings = get_embeddings([normalized_query], openai_api_key)
+        query_embedding = query_embeddings[0] if len(query_embeddings) else None
+        if query_embedding is not None:
+            similar_intent = _similar_cached_intent(query_embedding)
+            if similar_intent is not None:
+                print("Using cached intent for a semantically similar query.", file=sys.stderr)
+                return similar_intent
+
+        client = get_openai_client(openai_api_key)
         response = client.chat.completions.create(
-            model="gpt-4o",
+            model=INTENT_MODEL,
             messages=[
-                {"role": "system", "content": "You analyze data requirements for flood queries."},
-                {"role": "user", "content": prompt}
+                {"role": "system", "content": INTENT_SYSTEM_PROMPT},
+                {"role": "user", "content": query}
             ],
-            response_format={"type": "json_object"},
+            response_format=QUERY_INTENT_RESPONSE_FORMAT,
+            temperature=0,
+            max_tokens=200,
             timeout=15.0
         )
 
         content = response.choices[0].message.content
-        intent = json.loads(content)
-        # Basic validation (could be more thorough)
-        if not all(k in intent for k in default_intent.keys()):
-             print("Warning: OpenAI intent analysis response missing expected keys. Using defaults.", file=sys.stderr)
-             return default_intent
+        intent = QueryIntent.model_validate_json(content).model_dump()
+        _intent_memo[normalized_query] = intent
+        if query_embedding is not None:
+            _store_intent(normalized_query, query_embedding, intent)
         return intent
 
     except openai.APIError as e: print(f"OpenAI API Error analyzing intent: {e}", file=sys.stderr)
     except openai.APITimeoutError: print("OpenAI API request timed out analyzing intent.", file=sys.stderr)
-    except json.JSONDecodeError: print(f"OpenAI Invalid JSON response for intent. Content: {content}", file=sys.stderr)
+    except ValidationError: print(f"OpenAI intent response did not match the schema. Content: {content}", file=sys.stderr)
     except Exception as e:
-        print(f"Unexpected error analyzing query intent: {e}", file=sys.stderr)
-        traceback.print_exc(file=sys.stderr)
+        # One line per failure; the full traceback only with debug logging enabled
+        print(f"Unexpected error analyzing query intent: {type(e).__name__}: {e}", file=sys.stderr)
+        log.debug("Intent analysis traceback:", exc_info=True)
     # Return default on any error
     print("Using default intent due to analysis error.", file=sys.stderr)
     return default_intent
 
 
-def get_embeddings(texts: List[str], openai_api_key: str) -> List[List[float]]:
-    """Get embeddings using OpenAI."""
-    if not texts: return []
+EMBEDDING_BATCH_SIZE = 96
+
+
+def _request_embedding_batch(texts: List[str], openai_api_key: str) -> np.ndarray:
+    """Get embeddings from OpenAI in one request, as a (len(texts), D) float32 array (empty on error)."""
     try:
         if not openai_api_key: raise ValueError("OpenAI API Key missing for embeddings.")
-        client = openai.OpenAI(api_key=openai_api_key)
-        response = client.embeddings.create(model="text-embedding-3-large", input=texts, timeout=20.0)
-        return [item.embedding for item in response.data]
+        client = get_openai_client(openai_api_key)
+        # base64 returns packed float32 instead of decimal strings; decode it directly
+        response = client.embeddings.create(model=EMBEDDING_MODEL, input=texts, encoding_format="base64", timeout=20.0)
+        return np.stack([np.frombuffer(base64.b64decode(item.embedding), dtype=np.float32) for item in response.data])
     except openai.APIError as e: print(f"OpenAI API Error getting embeddings: {e}", file=sys.stderr)
     except openai.APITimeoutError: print("OpenAI API request timed out getting embeddings.", file=sys.stderr)
     except Exception as e:
-        print(f"Unexpected error getting embeddings: {e}", file=sys.stderr)
-        traceback.print_exc(file=sys.stderr)
-    return [] # Return empty list on error
+        print(f"Unexpected error getting embeddings: {type(e).__name__}: {e}", file=sys.stderr)
+        log.debug("Embeddings traceback:", exc_info=True)
+    return np.empty((0, 0), dtype=np.float32) # Return empty array on error
 
 
-def cosine_similarity(vec1: List[float], vec2: List[float]) -> float:
-    """Calculate cosine similarity."""
-    vec1, vec2 = np.array(vec1), np.array(vec2)
-    norm1, norm2 = np.linalg.norm(vec1), np.linalg.norm(vec2)
-    return np.dot(vec1, vec2) / (norm1 * norm2) if norm1 > 0 and norm2 > 0 else 0.0
+def _request_embeddings(texts: List[str], openai_api_key: str) -> np.ndarray:
+    """
+    Get embeddings from OpenAI, as a (len(texts), D) float32 array (empty on error).
+    Large inputs are split into EMBEDDING_BATCH_SIZE requests sent concurrently,
+    so no single request nears the API's per-request limits.
+    """
+    if not texts: return np.empty((0, 0), dtype=np.float32)
+    if len(texts) <= EMBEDDING_BATCH_SIZE:
+        return _request_embedding_batch(texts, openai_api_key)
+
+    batches = [texts[start:start + EMBEDDING_BATCH_SIZE] for start in range(0, len(texts), EMBEDDING_BATCH_SIZE)]
+    with ThreadPoolExecutor(max_workers=min(8, len(batches))) as executor:
+        results = list(executor.map(lambda batch: _request_embedding_batch(batch, openai_api_key), batches))
+    if any(len(result) != len(batch) for result, batch in zip(results, batches)):
+        return np.empty((0, 0), dtype=np.float32)
+    return np.concatenate(results)
+
+
+@functools.lru_cache(maxsize=4096)
+def _embedding_key(text: str) -> str:
+    """Cache key for the embedding of text, memoized so recurring texts are hashed once per process."""
+    return hashlib.sha256(f"{EMBEDDING_MODEL}\0{text}".encode()).hexdigest()
+
+
+def get_embeddings(texts: List[str], openai_api_key: str) -> np.ndarray:
+    """
+    Get embeddings as a (len(texts), D) float32 array (empty on error),
+    only calling OpenAI for texts not already in the on-disk cache.
+    """
+    if not texts: return np.empty((0, 0), dtype=np.float32)
+    keys = [_embedding_key(text) for text in texts]
+    cache = get_cache('embeddings')
+    embeddings = {key: cache.get(key) for key in keys}
+
+    missing = {key: text for key, text in zip(keys, texts) if embeddings[key] is None}
+    if missing:
+        log.debug("Embedding %d uncached texts...", len(missing))
+        new_embeddings = _request_embeddings(list(missing.values()), openai_api_key)
+        if len(new_embeddings) != len(missing):
+            return np.empty((0, 0), dtype=np.float32)
+        for key, embedding in zip(missing, new_embeddings):
+            # Stored as float16: half the disk space, and plenty of precision for
+            # the similarity comparisons (SVI variables, semantic intent cache)
+            embedding = np.asarray(embedding, dtype=np.float16)
+            cache.set(key, embedding)
+            embeddings[key] = embedding
+
+    return np.stack([embeddings[key] for key in keys]).astype(np.float32, copy=False)
+
+
+@functools.lru_cache(maxsize=1)
+def load_svi_context():
+    """
+    Load the SVI description file for semantic understanding of variables.
+    Read on first use and memoized, so importing this module does no file I/O.
+    """
+    try:
+        # Assuming prompts/ is relative to this script's location
+        script_dir = os.path.dirname(os.path.abspath(__file__))
+        svi_file_path = os.path.join(script_dir, 'prompts', 'social_vulnerability_index.txt')
+        with open(svi_file_path, 'r') as f:
+            return f.read()
+    except FileNotFoundError:
+        print("Warning: SVI context file not found at prompts/social_vulnerability_index.txt. Using basic understanding.", file=sys.stderr)
+        return ""
+    except Exception as e:
+        print(f"Error loading SVI context: {e}", file=sys.stderr)
+        return ""
+
+
+# Share of the SVI context embedding in a grounded embedding (see _embed_with_svi_context)
+SVI_CONTEXT_WEIGHT = 0.5
+
+
+def _embed_with_svi_context(texts: List[str], openai_api_key: str) -> np.ndarray:
+    """
+    Embeds texts on their own and grounds each one in the SVI description:
+    (1 - SVI_CONTEXT_WEIGHT) * unit(text) + SVI_CONTEXT_WEIGHT * unit(context).
+    The description is embedded once, as its own cached text, instead of being
+    concatenated into every text. Returns an empty array on failure.
+    """
+    svi_context = load_svi_context()
+    if not svi_context:
+        return get_embeddings(texts, openai_api_key)
+    # The context rides along in the same request (and cache) as the texts
+    embeddings = get_embeddings(list(texts) + [svi_context], openai_api_key)
+    if len(embeddings) == 0:
+        return embeddings
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    unit = np.divide(embeddings, norms, out=np.zeros_like(embeddings), where=norms > 0)
+    return (1.0 - SVI_CONTEXT_WEIGHT) * unit[:-1] + SVI_CONTEXT_WEIGHT * unit[-1]
+
+
+def get_svi_variable_embeddings(variable_names: List[str], openai_api_key: str) -> np.ndarray:
+    """
+    Get embeddings for SVI variables (each name embedded alone, grounded in the
+    SVI context) as a (len(variable_names), D) float32 array through the shared
+    embeddings cache. Returns an empty array on failure.
+    """
+    return _embed_with_svi_context(variable_names, openai_api_key)
+
 
+_unit_variable_matrices: Dict[tuple, np.ndarray] = {}
 
-def filter_svi_variables(svi_data: Dict[str, Any], query: str, api_key: str, threshold: float = 0.3) -> Dict[str, Any]:
-    """Filters SVI variables based on semantic similarity to the query."""
+
+def _unit_variable_matrix(variable_names: List[str], openai_api_key: str) -> np.ndarray:
+    """
+    Returns the SVI variable embeddings with rows scaled to unit length,
+    memoized per variable list so norms are computed once per process.
+    Returns an empty array on failure (not memoized).
+    """
+    key = tuple(variable_names)
+    matrix = _unit_variable_matrices.get(key)
+    if matrix is None:
+        matrix = get_svi_variable_embeddings(variable_names, openai_api_key)
+        if len(matrix) == 0:
+            return matrix
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix = np.divide(matrix, norms, out=np.zeros_like(matrix), where=norms > 0)
+        _unit_variable_matrices[key] = matrix
+    return matrix
+
+
+def embed_query(query: str, openai_api_key: str):
+    """Get the embedding of the query (grounded in the SVI context like the variables), or None on failure."""
+    embeddings = _embed_with_svi_context([query], openai_api_key)
+    return embeddings[0] if len(embeddings) else None
+
+
+def _shared_query_embedding(query: str, openai_api_key: str):
+    """
+    Returns a function that embeds the query on its first call and returns the
+    same embedding afterwards, so all locations share one embeddings call and
+    queries without SVI variables to filter make none.
+    """
+    lock = threading.Lock()
+    result = []
+
+    def get_query_embedding():
+        with lock:
+            if not result:
+                result.append(embed_query(query, openai_api_key))
+        return result[0]
+
+    return get_query_embedding
+
+
+def _svi_variables(svi_data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Collects the SVI variables into one {name: value} dict. 'variables' is flat
+    ({name: value}) as get_all_context returns it; variables nested under their
+    themes ({theme: {name: value}}) are accepted too.
+    """
+    all_vars = {}
+    if isinstance(svi_data, dict) and isinstance(svi_data.get('variables'), dict):
+        for key, value in svi_data['variables'].items():
+            if isinstance(value, dict):
+                all_vars.update(value)
+            else:
+                all_vars[key] = value
+    return all_vars
+
+
+def _query_similarities(query_embedding, variable_embeddings) -> np.ndarray:
+    """Cosine similarity of each variable embedding to the query embedding."""
+    if simsimd is not None:
+        q = np.asarray(query_embedding, dtype=np.float16)[None, :]
+        V = np.asarray(variable_embeddings, dtype=np.float16)
+        return 1.0 - np.asarray(simsimd.cdist(q, V, metric="cosine"), dtype=np.float32)[0]
+
+    # Works on the float32 arrays in place: no stacking of the query with the variables
+    q = np.asarray(query_embedding, dtype=np.float32)
+    V = np.asarray(variable_embeddings, dtype=np.float32)
+    denom = np.linalg.norm(V, axis=1) * np.linalg.norm(q)
+    return np.divide(V @ q, denom, out=np.zeros(len(V), dtype=np.float32), where=denom > 0)
+
+
+MIN_SVI_VARIABLES_TO_FILTER = 4
+
+
+_TOKEN_PATTERN = re.compile(r"[a-z]+")
+
+# Function words carry no topic, so they never count as a match on their own
+# (e.g. the "no" in "No Vehicle" or "is there no risk of flooding")
+_STOPWORDS = frozenset("""
+a about above after all an and any are as at be been before below being by can could did do does
+during except for from had has have how i if in into is it its me more most my near no not of on
+or other our over per should so than that the their them then there these they this those to
+under up was we were what when where which who why will with would you your
+""".split())
+
+
+def _content_tokens(text: str, exclude: frozenset = frozenset()) -> set:
+    """Lowercase words of text minus stopwords and excluded words, with a trailing plural 's' removed."""
+    tokens = set()
+    for token in _TOKEN_PATTERN.findall(text.lower()):
+        if token in _STOPWORDS or token in exclude:
+            continue
+        tokens.add(token[:-1] if len(token) > 3 and token.endswith('s') else token)
+    return tokens
+
+
+def _location_tokens(location_data: Dict[str, Any]) -> frozenset:
+    """
+    Words naming a retrieval result's place (input location, address, county,
+    state), e.g. "mobile" for Mobile, Alabama, so they do not match SVI variables.
+    """
+    place_texts = []
+    if isinstance(location_data, dict):
+        for section, fields in (('input_location', ('name', 'formatted_address')), ('county_data', ('county_name', 'state_name'))):
+            values = location_data.get(section)
+            if isinstance(values, dict):
+                place_texts.extend(str(values[field]) for field in fields if values.get(field))
+    return frozenset(_TOKEN_PATTERN.findall(" ".join(place_texts).lower()))
+
+
+def _lexical_decisions(query: str, variable_names: List[str], place_words: frozenset = frozenset()) -> Dict[str, bool]:
+    """
+    Decides variables whose relevance is obvious from the query's words, after
+    dropping stopwords and place names: True (keep) when every content word of
+    the variable name appears in the query, False (drop) when none does and the
+    query is only about the forecast.
+    Ambiguous variables are left out for the embedding comparison.
+    """
+    query_tokens = _content_tokens(query, place_words)
+    forecast_only = bool(_FORECAST_PATTERN.search(query)) and not _SVI_PATTERN.search(query)
+    decisions = {}
+    for name in variable_names:
+        name_tokens = _content_tokens(name)
+        if not name_tokens:
+            continue
+        matched = name_tokens & query_tokens
+        if matched == name_tokens:
+            decisions[name] = True
+        elif not matched and forecast_only:
+            decisions[name] = False
+    return decisions
+
+
+def filter_svi_variables(svi_data: Dict[str, Any], get_query_embedding, api_key: str, threshold: float = SVI_RELEVANCE_THRESHOLD, query: str = None, place_words: frozenset = frozenset()) -> Dict[str, Any]:
+    """
+    Filters SVI variables based on semantic similarity to the query.
+    get_query_embedding is called only if there are variables to filter (see _shared_query_embedding);
+    when the query text is given, variables it decides by keyword skip the embedding comparison.
+    place_words (see _location_tokens) are ignored in that keyword comparison.
+    """
     if not isinstance(svi_data, dict) or not isinstance(svi_data.get('variables'), dict) or not svi_data['variables']:
         # Return original structure even if empty or invalid, just without variables if they were invalid
         if isinstance(svi_data, dict):
@@ -126,61 +546,73 @@ def filter_svi_variables(svi_data: Dict[str, Any], query: str, api_key: str, thr
             return svi_data
         return {"variables": {}} # Return minimal valid structure
 
-    # SVI data structure changed: variables are nested under themes now
-    # We need to extract all variable names across themes
-    all_vars = {}
-    for theme, variables in svi_data['variables'].items():
-        if isinstance(variables, dict):
-            all_vars.update(variables)
+    # Variables are flat, or nested under themes in older retrieval data
+    all_vars = _svi_variables(svi_data)
 
     if not all_vars:
-        print("No SVI variables found to filter.", file=sys.stderr)
+        log.debug("No SVI variables found to filter.")
         return svi_data # Return original if no variables present
 
+    # Every variable would pass, or too few to be worth filtering: skip the embeddings entirely
+    if threshold <= 0.0 or len(all_vars) <= MIN_SVI_VARIABLES_TO_FILTER:
+        log.debug("Keeping all %d SVI variables (threshold: %s)", len(all_vars), threshold)
+        return svi_data
+
     variable_names = list(all_vars.keys())
-    variable_texts = [f"{name}: {SVI_CONTEXT}" if SVI_CONTEXT else name for name in variable_names]
-    query_text = f"Query: {query}\n\nContext: {SVI_CONTEXT}" if SVI_CONTEXT else query
 
-    print(f"Analyzing relevance of {len(variable_names)} SVI variables...", file=sys.stderr)
-    embeddings = get_embeddings([query_text] + variable_texts, api_key)
+    log.debug("Analyzing relevance of %d SVI variables...", len(variable_names))
+    # Variables whose relevance is obvious from the query's words need no embeddings
+    decisions = _lexical_decisions(query, variable_names, place_words) if query else {}
 
-    if not embeddings or len(embeddings) < 2:
-        print("Warning: Could not get embeddings for SVI filtering. Keeping all variables.", file=sys.stderr)
-        return svi_data # Return original on embedding failure
+    if len(decisions) < len(variable_names):
+        # Variable embeddings are cached; the query embedding is shared across locations
+        query_embedding = get_query_embedding()
+        unit_variables = _unit_variable_matrix(variable_names, api_key) if query_embedding is not None else None
 
-    query_embedding, variable_embeddings = embeddings[0], embeddings[1:]
-    similarities = [(name, cosine_similarity(query_embedding, var_emb), all_vars[name])
-                    for name, var_emb in zip(variable_names, variable_embeddings)]
-    similarities.sort(key=lambda x: x[1], reverse=True)
+        if unit_variables is None or len(unit_variables) == 0:
+            log.warning("Could not get embeddings for SVI filtering. Keeping all variables.")
+            return svi_data # Return original on embedding failure
 
-    # Reconstruct the nested variable structure with filtered items
-    filtered_nested_vars = {}
+        # Variable rows are already unit length, so only the query needs normalizing
+        q = np.asarray(query_embedding, dtype=np.float32)
+        q_norm = np.linalg.norm(q)
+        scores = unit_variables @ (q / q_norm) if q_norm > 0 else np.zeros(len(unit_variables), dtype=np.float32)
+    else:
+        log.debug("All SVI variables decided by keywords; skipping embeddings.")
+        scores = np.zeros(len(variable_names), dtype=np.float32)
+
+    for i, name in enumerate(variable_names):
+        if name in decisions:
+            scores[i] = 1.0 if decisions[name] else 0.0
+    sim_by_name = dict(zip(variable_names, scores.tolist()))
+
+    # Rebuild the variables in their original shape (flat or nested) with the kept items
+    filtered_vars = {}
     kept_count = 0
-    for theme, variables in svi_data['variables'].items():
-         if isinstance(variables, dict):
-             theme_filtered = {}
-             for name, value in variables.items():
-                 # Find the similarity score for this variable
-                 sim_score = next((sim for var_name, sim, _ in similarities if var_name == name), 0.0)
-                 if sim_score >= threshold:
-                     theme_filtered[name] = value
-                     kept_count += 1
-             if theme_filtered: # Only add theme if it has relevant variables
-                 filtered_nested_vars[theme] = theme_filtered
-
-
-    print(f"Kept {kept_count}/{len(variable_names)} SVI variables (threshold: {threshold})", file=sys.stderr)
-    if kept_count > 0 and kept_count < len(variable_names): # Only print if filtering happened
-        print("Most relevant SVI variables (top 5 matching threshold):", file=sys.stderr)
-        count = 0
-        for name, sim, _ in similarities:
-            if sim >= threshold and count < 5:
-                print(f"  - {name} (similarity: {sim:.3f})", file=sys.stderr)
-                count += 1
+    for key, value in svi_data['variables'].items():
+        if isinstance(value, dict):
+            theme_filtered = {name: v for name, v in value.items() if sim_by_name.get(name, 0.0) >= threshold}
+            kept_count += len(theme_filtered)
+            if theme_filtered: # Only add theme if it has relevant variables
+                filtered_vars[key] = theme_filtered
+        elif sim_by_name.get(key, 0.0) >= threshold:
+            filtered_vars[key] = value
+            kept_count += 1
+
+    log.debug("Kept %d/%d SVI variables (threshold: %s)", kept_count, len(variable_names), threshold)
+    if kept_count > 0 and kept_count < len(variable_names) and log.isEnabledFor(logging.DEBUG): # Only log if filtering happened
+        log.debug("Most relevant SVI variables (top 5 matching threshold):")
+        # Select the top 5 with a partial partition instead of sorting every score
+        candidates = np.flatnonzero(scores >= threshold)
+        k = min(5, len(candidates))
+        if k:
+            top = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+            for idx in top[np.argsort(-scores[top])]:
+                log.debug("  - %s (similarity: %.3f)", variable_names[idx], scores[idx])
 
     # Return structure consistent with original, but with filtered variables
     filtered_svi = svi_data.copy() # Start with a copy
-    filtered_svi["variables"] = filtered_nested_vars # Replace with filtered nested structure
+    filtered_svi["variables"] = filtered_vars # Replace with the filtered variables
 
     return filtered_svi
 
@@ -189,121 +621,186 @@ def filter_flood_events(flood_events: List[Dict[str, Any]], filters: Dict[str, A
     """Filters flood events based on distance and max count."""
     if not flood_events or not isinstance(flood_events, list): return []
 
-    filtered = flood_events
-    original_count = len(filtered)
-
-    # Filter by distance
     max_dist = filters.get('max_distance_miles')
-    if max_dist is not None and isinstance(max_dist, (int, float)) and max_dist >= 0:
-        filtered = [e for e in filtered if e.get('distance_from_query_point_miles', float('inf')) <= max_dist]
-        if len(filtered) < original_count:
-             print(f"Filtered to {len(filtered)} events within {max_dist} miles.", file=sys.stderr)
+    if max_dist is None or not isinstance(max_dist, (int, float)) or max_dist < 0:
+        max_dist = None
+
+    max_events = filters.get('max_events')
+    if max_events is None or not isinstance(max_events, int) or max_events <= 0:
+        max_events = len(flood_events)
 
     # Filter by recency (basic example: keep only last N years - not implemented per prompt)
     # if filters.get('recent_only'): pass # Add date filtering logic if needed
 
-    # Limit number of events (applied *after* distance filter)
-    max_events = filters.get('max_events')
-    if max_events is not None and isinstance(max_events, int) and max_events > 0 and len(filtered) > max_events:
-        print(f"Limiting {len(filtered)} events to the nearest {max_events}.", file=sys.stderr)
-        filtered = filtered[:max_events]
+    # Nothing to filter out: distances are never compared
+    if max_dist is None and max_events >= len(flood_events):
+        return flood_events
+
+    # Keep the max_events nearest events within the distance limit, whatever the
+    # input order; nsmallest keeps a bounded heap instead of sorting everything.
+    # Events without a distance (missing or null) sort last and never pass a limit.
+    def distance(event):
+        miles = event.get('distance_from_query_point_miles')
+        return miles if miles is not None else float('inf')
 
+    within_limit = flood_events if max_dist is None else (event for event in flood_events if distance(event) <= max_dist)
+    filtered = heapq.nsmallest(max_events, within_limit, key=distance)
+
+    if len(filtered) < len(flood_events):
+        log.debug("Kept %d of %d events (max distance: %s miles, max events: %d).", len(filtered), len(flood_events), max_dist, max_events)
     return filtered
 
 
-def select_relevant_context(retrieval_results: List[Dict[str, Any]], user_query: str, openai_api_key: str) -> Dict[str, Any]:
+def filter_precipitation_history(history: List[Dict[str, Any]], recent_only: bool) -> List[Dict[str, Any]]:
+    """Keeps only the last RECENT_YEARS years of monthly precipitation when recent_only is set."""
+    if not history or not recent_only:
+        return history
+    first_year = max(row['year'] for row in history) - RECENT_YEARS + 1
+    recent = [row for row in history if row['year'] >= first_year]
+    log.debug("Limited precipitation history to %d months since %d.", len(recent), first_year)
+    return recent
+
+
+def _filter_location(i: int, location_data: Dict[str, Any], intent: Dict[str, Any], user_query: str, get_query_embedding, openai_api_key: str):
     """
-    Main function: analyzes intent, filters data based on intent.
+    Filters one location's data based on intent.
+    Returns the filtered location, or None if the data is not a valid location.
     """
-    print("\n" + "="*50, file=sys.stderr)
-    print("INTELLIGENT CONTEXT SELECTION", file=sys.stderr)
-    print("="*50, file=sys.stderr)
+    # Basic check for valid location data structure
+    if not isinstance(location_data, dict) or 'input_location' not in location_data:
+         log.warning("Skipping invalid location data structure at index %d", i)
+         return None
+
+    location_name = location_data.get("input_location", {}).get("name", f"Location {i+1}")
+    log.debug("--- Filtering data for: %s ---", location_name)
+    filtered_location = {"input_location": location_data["input_location"]}
+
+    # Always include status if present
+    if 'status' in location_data:
+        filtered_location['status'] = location_data['status']
+        # If status indicates no county/FIPS, we might skip DB lookups based on intent
+        if location_data['status'] in ["No county found", "Missing FIPS code", "Missing coordinates"]:
+             if intent.get('needs_precipitation_forecast') and "precipitation_forecast" in location_data:
+                 filtered_location["precipitation_forecast"] = location_data["precipitation_forecast"]
+                 log.debug("  - Included precipitation forecast (county independent).")
+             log.debug("  - Skipping further data for %s due to status: %s", location_name, location_data['status'])
+             return filtered_location # Skip DB-dependent data for this location
+
+
+    # Conditionally include/filter based on intent
+    if intent.get('needs_county_info') and "county_data" in location_data:
+        filtered_location["county_data"] = location_data["county_data"]
+        log.debug("  - Included county data.")
+
+    if intent.get('needs_precipitation_history') and "precipitation_history" in location_data:
+        filtered_location["precipitation_history"] = filter_precipitation_history(
+            location_data["precipitation_history"], intent.get('recent_precipitation_only', False)
+        )
+        log.debug("  - Included precipitation history.")
+
+    if intent.get('needs_precipitation_forecast') and "precipitation_forecast" in location_data:
+        filtered_location["precipitation_forecast"] = location_data["precipitation_forecast"]
+        log.debug("  - Included precipitation forecast.")
+
+    if intent.get('needs_flood_history') and "flood_event_history" in location_data:
+        log.debug("[Step 2] Filtering flood events for %s...", location_name)
+        flood_events = location_data["flood_event_history"]
+        filtered_events = filter_flood_events(flood_events, intent.get('flood_event_filters', {}))
+        if filtered_events: # Only include if not empty after filtering
+            filtered_location["flood_event_history"] = filtered_events
+            log.debug("  - Included %d filtered flood events.", len(filtered_events))
+        else:
+             log.debug("  - No flood events remained after filtering.")
+
+
+    if intent.get('needs_svi_data') and "social_vulnerability_index" in location_data:
+        log.debug("[Step 3] Filtering SVI variables for %s...", location_name)
+        svi_data = location_data["social_vulnerability_index"]
+        if svi_data: # Ensure SVI data exists before trying to filter
+            threshold = intent.get('svi_relevance_threshold', SVI_RELEVANCE_THRESHOLD)
+            filtered_svi = filter_svi_variables(
+                svi_data, get_query_embedding, openai_api_key, threshold,
+                query=user_query, place_words=_location_tokens(location_data)
+            )
+            # Only include SVI if filtering didn't remove everything meaningful
+            if (filtered_svi.get("overall_ranking") and (filtered_svi["overall_ranking"].get("national") is not None or filtered_svi["overall_ranking"].get("state") is not None)) \
+            or filtered_svi.get("themes") \
+            or filtered_svi.get("variables"):
+                filtered_location["social_vulnerability_index"] = filtered_svi
+                log.debug("  - Included filtered SVI data.")
+            else:
+                log.debug("  - No relevant SVI data remained after filtering.")
 
-    print("\n[Step 1] Analyzing query intent...", file=sys.stderr)
-    intent = analyze_query_intent(user_query, openai_api_key)
+        else:
+             log.debug("  - No SVI data was available to filter.")
 
-    print("Intent Analysis:", file=sys.stderr)
-    print(f"  - Needs Forecast: {intent.get('needs_precipitation_forecast')}", file=sys.stderr)
-    print(f"  - Needs Precip History: {intent.get('needs_precipitation_history')}", file=sys.stderr)
-    print(f"  - Needs Flood History: {intent.get('needs_flood_history')}", file=sys.stderr)
-    print(f"  - Needs SVI: {intent.get('needs_svi_data')}", file=sys.stderr)
-    print(f"  - Needs County Info: {intent.get('needs_county_info')}", file=sys.stderr)
+    return filtered_location
 
-    filtered_results = []
-    step_counter = 1 # Start step numbering for filtering
 
+def resolve_query_intent(user_query: str, openai_api_key: str, intent: Dict[str, Any] = None) -> Dict[str, Any]:
+    """
+    Returns the intent to filter with, analyzing the query unless a precomputed
+    intent (e.g. from rule_based_intent) is given.
+    """
+    log.debug("INTELLIGENT CONTEXT SELECTION")
+
+    if intent is None:
+        log.debug("[Step 1] Analyzing query intent...")
+        intent = analyze_query_intent(user_query, openai_api_key)
+    else:
+        log.debug("[Step 1] Using precomputed query intent.")
+
+    log.debug(
+        "Intent Analysis: forecast=%s, precip history=%s, flood history=%s, SVI=%s, county info=%s",
+        intent.get('needs_precipitation_forecast'), intent.get('needs_precipitation_history'),
+        intent.get('needs_flood_history'), intent.get('needs_svi_data'), intent.get('needs_county_info')
+    )
+    return intent
+
+
+def iter_relevant_context(retrieval_results: Iterable[Dict[str, Any]], user_query: str, openai_api_key: str, intent: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """
+    Filters locations one at a time as they are consumed, so retrieval results
+    can be streamed without holding them all in memory.
+    """
+    get_query_embedding = _shared_query_embedding(user_query, openai_api_key)
     for i, location_data in enumerate(retrieval_results):
-        # Basic check for valid location data structure
-        if not isinstance(location_data, dict) or 'input_location' not in location_data:
-             print(f"Warning: Skipping invalid location data structure at index {i}", file=sys.stderr)
-             continue
-
-        location_name = location_data.get("input_location", {}).get("name", f"Location {i+1}")
-        print(f"\n--- Filtering data for: {location_name} ---", file=sys.stderr)
-        filtered_location = {"input_location": location_data["input_location"]}
-
-        # Always include status if present
-        if 'status' in location_data:
-            filtered_location['status'] = location_data['status']
-            # If status indicates no county/FIPS, we might skip DB lookups based on intent
-            if location_data['status'] in ["No county found", "Missing FIPS code", "Missing coordinates"]:
-                 if intent.get('needs_precipitation_forecast') and "precipitation_forecast" in location_data:
-                     filtered_location["precipitation_forecast"] = location_data["precipitation_forecast"]
-                     print("  - Included precipitation forecast (county independent).", file=sys.stderr)
-                 filtered_results.append(filtered_location)
-                 print(f"  - Skipping further data for {location_name} due to status: {location_data['status']}", file=sys.stderr)
-                 continue # Skip DB-dependent data for this location
-
-
-        # Conditionally include/filter based on intent
-        if intent.get('needs_county_info') and "county_data" in location_data:
-            filtered_location["county_data"] = location_data["county_data"]
-            print("  - Included county data.", file=sys.stderr)
-
-        if intent.get('needs_precipitation_history') and "precipitation_history" in location_data:
-            filtered_location["precipitation_history"] = location_data["precipitation_history"]
-            print("  - Included precipitation history.", file=sys.stderr)
-
-        if intent.get('needs_precipitation_forecast') and "precipitation_forecast" in location_data:
-            filtered_location["precipitation_forecast"] = location_data["precipitation_forecast"]
-            print("  - Included precipitation forecast.", file=sys.stderr)
-
-        if intent.get('needs_flood_history') and "flood_event_history" in location_data:
-            step_counter += 1
-            print(f"\n[Step {step_counter}] Filtering flood events for {location_name}...", file=sys.stderr)
-            flood_events = location_data["flood_event_history"]
-            filtered_events = filter_flood_events(flood_events, intent.get('flood_event_filters', {}))
-            if filtered_events: # Only include if not empty after filtering
-                filtered_location["flood_event_history"] = filtered_events
-                print(f"  - Included {len(filtered_events)} filtered flood events.", file=sys.stderr)
-            else:
-                 print("  - No flood events remained after filtering.", file=sys.stderr)
-
-
-        if intent.get('needs_svi_data') and "social_vulnerability_index" in location_data:
-            step_counter += 1
-            print(f"\n[Step {step_counter}] Filtering SVI variables for {location_name}...", file=sys.stderr)
-            svi_data = location_data["social_vulnerability_index"]
-            if svi_data: # Ensure SVI data exists before trying to filter
-                threshold = intent.get('svi_relevance_threshold', 0.3)
-                filtered_svi = filter_svi_variables(svi_data, user_query, openai_api_key, threshold)
-                # Only include SVI if filtering didn't remove everything meaningful
-                if (filtered_svi.get("overall_ranking") and (filtered_svi["overall_ranking"].get("national") is not None or filtered_svi["overall_ranking"].get("state") is not None)) \
-                or filtered_svi.get("themes") \
-                or filtered_svi.get("variables"):
-                    filtered_location["social_vulnerability_index"] = filtered_svi
-                    print("  - Included filtered SVI data.", file=sys.stderr)
-                else:
-                    print("  - No relevant SVI data remained after filtering.", file=sys.stderr)
+        filtered_location = _filter_location(i, location_data, intent, user_query, get_query_embedding, openai_api_key)
+        if filtered_location is not None:
+            yield filtered_location
 
-            else:
-                 print("  - No SVI data was available to filter.", file=sys.stderr)
 
-        filtered_results.append(filtered_location)
+def select_relevant_context(retrieval_results: List[Dict[str, Any]], user_query: str, openai_api_key: str, intent: Dict[str, Any] = None) -> Dict[str, Any]:
+    """
+    Main function: analyzes intent, filters data based on intent.
+    A precomputed intent (e.g. from rule_based_intent) skips the OpenAI analysis.
+    """
+    intent = resolve_query_intent(user_query, openai_api_key, intent)
+    get_query_embedding = _shared_query_embedding(user_query, openai_api_key)
+
+    # The same SVI variables appear for every location: embed any uncached ones
+    # in a single batch up front so the location threads only read the cache
+    if intent.get('needs_svi_data') and intent.get('svi_relevance_threshold', SVI_RELEVANCE_THRESHOLD) > 0.0:
+        variable_names = set()
+        for location_data in retrieval_results:
+            if isinstance(location_data, dict):
+                location_vars = _svi_variables(location_data.get('social_vulnerability_index'))
+                if len(location_vars) > MIN_SVI_VARIABLES_TO_FILTER:
+                    variable_names.update(location_vars)
+        if variable_names:
+            get_svi_variable_embeddings(sorted(variable_names), openai_api_key)
+
+    # Locations are independent, so filter them concurrently (in input order);
+    # a single location, the common case, is filtered inline without a pool
+    filter_one = lambda item: _filter_location(item[0], item[1], intent, user_query, get_query_embedding, openai_api_key)
+    if len(retrieval_results) <= 1:
+        filtered = [filter_one(item) for item in enumerate(retrieval_results)]
+    else:
+        with ThreadPoolExecutor(max_workers=min(8, len(retrieval_results))) as executor:
+            filtered = list(executor.map(filter_one, enumerate(retrieval_results)))
+    filtered_results = [location for location in filtered if location is not None]
 
-    print("\n" + "="*50, file=sys.stderr)
-    print("CONTEXT SELECTION COMPLETE", file=sys.stderr)
-    print("="*50, file=sys.stderr)
+    log.debug("CONTEXT SELECTION COMPLETE")
 
     # Return structure expected by generate_llm_answer
     return {
@@ -313,12 +810,32 @@ def select_relevant_context(retrieval_results: List[Dict[str, Any]], user_query:
     }
 
 
+def iter_retrieval_results(json_path: str) -> Iterator[Dict[str, Any]]:
+    """
+    Yields retrieval results one location at a time from a JSON file holding
+    either the full get_flood_context output or just the list of locations.
+    Parses incrementally with ijson when installed.
+    """
+    with open(json_path, 'rb') as f:
+        if ijson is None:
+            data = orjson.loads(f.read())
+            yield from data['full_retrieval_data'] if isinstance(data, dict) else data
+            return
+
+        # The full output is an object whose 'full_retrieval_data' holds the list
+        head = f.read(64).lstrip()
+        f.seek(0)
+        prefix = 'full_retrieval_data.item' if head.startswith(b'{') else 'item'
+        yield from ijson.items(f, prefix, use_float=True)
+
+
 # --- Main function for direct testing (prints to stderr) ---
 def main_test():
     """
     Main function for testing the selection system interactively.
     """
     load_dotenv() # Load from project root .env expected here
+    logging.basicConfig(level=logging.DEBUG, stream=sys.stderr, format="%(message)s")
     OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
     if not OPENAI_API_KEY:
         print("Error: OPENAI_API_KEY not found in environment for testing.", file=sys.stderr)
@@ -334,61 +851,37 @@ def main_test():
     print("For testing, provide the path to a JSON file with retrieval results:", file=sys.stderr)
 
     json_path = input("Path to retrieval results JSON (e.g., flood_query_results.json): ").strip()
-    retrieval_results = None
-
-    if json_path and os.path.exists(json_path):
-        try:
-            with open(json_path, 'r') as f:
-                # Assuming the file contains the *full* output from get_flood_context
-                # which includes the 'full_retrieval_data' key
-                full_data = json.load(f)
-                if isinstance(full_data, dict) and 'full_retrieval_data' in full_data:
-                     retrieval_results = full_data['full_retrieval_data']
-                     print(f"Loaded 'full_retrieval_data' from {json_path}", file=sys.stderr)
-                else:
-                     # Maybe the file *only* contains the list?
-                     retrieval_results = full_data
-                     print(f"Loaded raw data from {json_path} (assuming it's the retrieval list)", file=sys.stderr)
-
-        except json.JSONDecodeError:
-            print(f"Error: Could not parse JSON from {json_path}", file=sys.stderr)
-        except Exception as e:
-            print(f"Error loading file {json_path}: {e}", file=sys.stderr)
-    else:
+    if not (json_path and os.path.exists(json_path)):
         print("No valid file provided or file not found.", file=sys.stderr)
+        print("Could not load retrieval results. Cannot run context selection.", file=sys.stderr)
+        return
 
+    intent = resolve_query_intent(example_query, OPENAI_API_KEY)
 
-    if retrieval_results is not None:
-         # Check if retrieval_results is a list, as expected
-         if not isinstance(retrieval_results, list):
-             print(f"Error: Loaded data from {json_path} is not a list as expected. Type: {type(retrieval_results)}", file=sys.stderr)
-             return
-
-         # Run the selection
-         selected_context = select_relevant_context(
-             retrieval_results,
-             example_query,
-             OPENAI_API_KEY
-         )
-
-         # Print results nicely to stderr for testing
-         print("\n" + "="*50, file=sys.stderr)
-         print("FILTERED CONTEXT (Ready for LLM)", file=sys.stderr)
-         print("="*50, file=sys.stderr)
-         print(json.dumps(selected_context, indent=2), file=sys.stderr)
-
-         # Optionally save to file
-         save = input("\nSave filtered context to file? (y/n): ").strip().lower()
-         if save == 'y':
-             output_path = "filtered_context_test_output.json"
-             try:
-                 with open(output_path, 'w') as f:
-                     json.dump(selected_context, f, indent=2)
-                 print(f"Saved to {output_path}", file=sys.stderr)
-             except Exception as e:
-                  print(f"Error saving file: {e}", file=sys.stderr)
-    else:
-        print("Could not load retrieval results. Cannot run context selection.", file=sys.stderr)
+    # Stream locations from the input file through the selection and write each
+    # filtered location to the output file as soon as it is ready
+    output_path = "filtered_context_test_output.json"
+    count = 0
+    try:
+        with open(output_path, 'wb') as out:
+            out.write(b'{"query":' + orjson.dumps(example_query))
+            out.write(b',"intent_analysis":' + orjson.dumps(intent))
+            out.write(b',"filtered_data":[')
+            for location in iter_relevant_context(iter_retrieval_results(json_path), example_query, OPENAI_API_KEY, intent):
+                # Print results nicely to stderr for testing
+                print(orjson.dumps(location, option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY).decode(), file=sys.stderr)
+                if count:
+                    out.write(b",")
+                out.write(orjson.dumps(location, option=orjson.OPT_SERIALIZE_NUMPY))
+                count += 1
+            out.write(b"]}\n")
+    except Exception as e:
+        print(f"Error processing {json_path}: {e}", file=sys.stderr)
+        return
+
+    print("\n" + "="*50, file=sys.stderr)
+    print(f"Saved {count} filtered location(s) to {output_path}", file=sys.stderr)
+    print("="*50, file=sys.stderr)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,231 @@
+"""
+Tests for the filtering helpers in select_function.
+
+Run from AI_assistance_map/ with: python -m unittest discover -s tests
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import diskcache
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import select_function
+from select_function import (
+    _filter_location, _lexical_decisions, _location_tokens, filter_flood_events, filter_precipitation_history,
+    filter_svi_variables, rule_based_intent
+)
+
+
+SVI_VARIABLES = [
+    'Below 150% Poverty', 'Unemployed', 'Housing Cost Burden', 'No High School Diploma',
+    'No Health Insurance', 'Aged 65 & Older', 'Aged 17 & Younger', 'Civilian with a Disability',
+    'Single-Parent Households', 'English Language Proficiency (limited)',
+    'Minority (all except white, non-Hispanic)', 'Multi-Unit Structures (10+)', 'Mobile Homes',
+    'Crowding (>1 person/room)', 'No Vehicle', 'Group Quarters'
+]
+
+MOBILE_LOCATION = {
+    'input_location': {'name': 'Mobile, Alabama', 'formatted_address': 'Mobile, AL, USA'},
+    'county_data': {'county_name': 'Mobile', 'state_name': 'Alabama'}
+}
+
+
+class LexicalDecisionsTest(unittest.TestCase):
+
+    def test_place_name_does_not_keep_variable(self):
+        decisions = _lexical_decisions(
+            "What is the flood history in Mobile, Alabama?", SVI_VARIABLES, _location_tokens(MOBILE_LOCATION)
+        )
+        self.assertNotIn('Mobile Homes', decisions)
+
+    def test_stopword_does_not_keep_variable(self):
+        decisions = _lexical_decisions("Is there no risk of flooding in Tuscaloosa?", SVI_VARIABLES)
+        self.assertNotIn('No Vehicle', decisions)
+        self.assertNotIn('No Health Insurance', decisions)
+
+    def test_partial_name_match_is_left_to_embeddings(self):
+        decisions = _lexical_decisions("Which homes flooded here before?", SVI_VARIABLES)
+        self.assertNotIn('Mobile Homes', decisions)
+
+    def test_full_name_match_keeps_variable(self):
+        self.assertTrue(_lexical_decisions("How many households have no vehicle?", SVI_VARIABLES)['No Vehicle'])
+        self.assertTrue(_lexical_decisions("Are mobile homes at risk of flooding?", SVI_VARIABLES)['Mobile Homes'])
+        self.assertTrue(_lexical_decisions("Is poverty high here?", SVI_VARIABLES)['Below 150% Poverty'])
+
+    def test_forecast_only_query_drops_unmatched_variables(self):
+        decisions = _lexical_decisions(
+            "Will it rain tomorrow in Mobile?", SVI_VARIABLES, _location_tokens(MOBILE_LOCATION)
+        )
+        self.assertFalse(decisions['Mobile Homes'])
+        self.assertFalse(decisions['No Vehicle'])
+
+
+class LocationTokensTest(unittest.TestCase):
+
+    def test_collects_place_words(self):
+        self.assertEqual(_location_tokens(MOBILE_LOCATION), {'mobile', 'alabama', 'al', 'usa'})
+
+    def test_invalid_location_data(self):
+        self.assertEqual(_location_tokens(None), frozenset())
+        self.assertEqual(_location_tokens({'input_location': 'Mobile'}), frozenset())
+
+
+def _flat_svi():
+    """SVI data in the shape get_all_context returns: 'variables' is a flat {name: value} object."""
+    return {
+        'release_year': 2022,
+        'overall_ranking': {'national': 0.651, 'state': 0.2879},
+        'themes': {'Socioeconomic Status': 0.2576, 'Housing Type & Transportation': 0.7879},
+        'variables': {name: round(0.05 * i, 2) for i, name in enumerate(SVI_VARIABLES)}
+    }
+
+
+class FilterSviVariablesTest(unittest.TestCase):
+    """Runs filter_svi_variables end to end with one-hot stub embeddings per variable."""
+
+    def setUp(self):
+        select_function._unit_variable_matrices.clear()
+        self.embed_calls = []
+
+        def fake_variable_embeddings(names, api_key):
+            self.embed_calls.append(list(names))
+            return np.eye(len(SVI_VARIABLES), dtype=np.float32)[[SVI_VARIABLES.index(name) for name in names]]
+
+        patcher = mock.patch.object(select_function, 'get_svi_variable_embeddings', side_effect=fake_variable_embeddings)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(select_function._unit_variable_matrices.clear)
+
+    def _query_embedding(self, *names):
+        query = np.zeros(len(SVI_VARIABLES), dtype=np.float32)
+        for name in names:
+            query[SVI_VARIABLES.index(name)] = 1.0
+        return mock.Mock(return_value=query)
+
+    def test_flat_variables_are_filtered(self):
+        get_query_embedding = self._query_embedding('No Vehicle', 'Mobile Homes')
+        filtered = filter_svi_variables(
+            _flat_svi(), get_query_embedding, 'key', threshold=0.3, query="Which residents would struggle to evacuate?"
+        )
+        self.assertEqual(set(filtered['variables']), {'No Vehicle', 'Mobile Homes'})
+        self.assertEqual(filtered['variables']['No Vehicle'], _flat_svi()['variables']['No Vehicle'])
+        self.assertEqual(filtered['themes'], _flat_svi()['themes'])
+        self.assertEqual(filtered['overall_ranking'], _flat_svi()['overall_ranking'])
+        get_query_embedding.assert_called_once()
+        self.assertEqual(self.embed_calls, [list(_flat_svi()['variables'])])
+
+    def test_keyword_decision_on_flat_variables(self):
+        get_query_embedding = self._query_embedding('No Vehicle')
+        filtered = filter_svi_variables(
+            _flat_svi(), get_query_embedding, 'key', threshold=0.3, query="How is poverty related to evacuation?"
+        )
+        self.assertEqual(set(filtered['variables']), {'No Vehicle', 'Below 150% Poverty'})
+
+    def test_nested_variables_keep_their_themes(self):
+        svi = _flat_svi()
+        svi['variables'] = {
+            'Socioeconomic Status': {name: svi['variables'][name] for name in SVI_VARIABLES[:5]},
+            'Housing Type & Transportation': {name: svi['variables'][name] for name in SVI_VARIABLES[11:]}
+        }
+        filtered = filter_svi_variables(
+            svi, self._query_embedding('Unemployed', 'No Vehicle'), 'key', threshold=0.3, query="Who is affected?"
+        )
+        self.assertEqual(filtered['variables'], {
+            'Socioeconomic Status': {'Unemployed': svi['variables']['Socioeconomic Status']['Unemployed']},
+            'Housing Type & Transportation': {'No Vehicle': svi['variables']['Housing Type & Transportation']['No Vehicle']}
+        })
+
+
+class IntentIndexTest(unittest.TestCase):
+    """The semantic intent lookup reads one capped embedding index."""
+
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.cache = diskcache.Cache(tmpdir.name)
+        self.addCleanup(self.cache.close)
+        for patcher in (mock.patch.object(select_function, 'get_cache', return_value=self.cache),
+                        mock.patch.object(select_function, 'INTENT_INDEX_MAX_ENTRIES', 3)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        rng = np.random.default_rng(0)
+        self.embeddings = {query: rng.normal(size=16).astype(np.float32) for query in 'abcde'}
+
+    def test_similar_query_reuses_intent(self):
+        self.assertIsNone(select_function._similar_cached_intent(self.embeddings['a']))
+        select_function._store_intent('a', self.embeddings['a'], {'query': 'a'})
+        self.assertEqual(select_function._similar_cached_intent(self.embeddings['a'] + 0.01), {'query': 'a'})
+        self.assertIsNone(select_function._similar_cached_intent(self.embeddings['e']))
+
+    def test_index_keeps_most_recent_queries(self):
+        for query in 'abcda':
+            select_function._store_intent(query, self.embeddings[query], {'query': query})
+        queries, matrix = self.cache.get(select_function._INTENT_INDEX_KEY)
+        self.assertEqual(queries, ['c', 'd', 'a'])
+        self.assertEqual(matrix.shape, (3, 16))
+        self.assertIsNone(select_function._similar_cached_intent(self.embeddings['b']))
+
+
+def _events(*distances):
+    return [{'id': i, 'distance_from_query_point_miles': miles} for i, miles in enumerate(distances)]
+
+
+class FilterFloodEventsTest(unittest.TestCase):
+
+    def test_no_filters_returns_events_unchanged(self):
+        events = _events(5.0, None, 1.0)
+        self.assertIs(filter_flood_events(events, {}), events)
+
+    def test_max_events_keeps_nearest(self):
+        kept = filter_flood_events(_events(5.0, 1.0, 3.0, 9.0), {'max_events': 2})
+        self.assertEqual([event['id'] for event in kept], [1, 2])
+
+    def test_max_distance(self):
+        kept = filter_flood_events(_events(5.0, 1.0, 3.0), {'max_distance_miles': 4})
+        self.assertEqual([event['id'] for event in kept], [1, 2])
+
+    def test_null_or_missing_distance(self):
+        events = _events(2.0, None, 1.0) + [{'id': 3}]
+        self.assertEqual([event['id'] for event in filter_flood_events(events, {'max_events': 3})], [2, 0, 1])
+        self.assertEqual([event['id'] for event in filter_flood_events(events, {'max_distance_miles': 10})], [2, 0])
+
+
+def _monthly_history(first_year, last_year):
+    return [{'year': year, 'month': month, 'precipitation_in': 1.0}
+            for year in range(first_year, last_year + 1) for month in range(1, 13)]
+
+
+class PrecipitationHistoryTest(unittest.TestCase):
+    """Precipitation recency has its own intent flag, separate from the flood event filters."""
+
+    def test_recent_only_keeps_last_years(self):
+        recent = filter_precipitation_history(_monthly_history(2010, 2024), True)
+        self.assertEqual({row['year'] for row in recent}, set(range(2020, 2025)))
+        self.assertEqual(len(filter_precipitation_history(_monthly_history(2010, 2024), False)), 15 * 12)
+
+    def test_rule_based_intent_sets_flag(self):
+        self.assertTrue(rule_based_intent("How much has it rained recently in Mobile?")['recent_precipitation_only'])
+        self.assertFalse(rule_based_intent("What is the rainfall history in Mobile?")['recent_precipitation_only'])
+
+    def test_location_filter_reads_precipitation_flag(self):
+        location = dict(MOBILE_LOCATION, precipitation_history=_monthly_history(2010, 2024))
+        intent = {
+            'needs_precipitation_history': True, 'recent_precipitation_only': True,
+            'flood_event_filters': {'max_events': 10, 'max_distance_miles': None, 'recent_only': False}
+        }
+        filtered = _filter_location(0, location, intent, "Recent rainfall in Mobile?", None, 'key')
+        self.assertEqual(len(filtered['precipitation_history']), 5 * 12)
+
+        intent.update(recent_precipitation_only=False, flood_event_filters={'recent_only': True})
+        filtered = _filter_location(0, location, intent, "Rainfall in Mobile?", None, 'key')
+        self.assertEqual(len(filtered['precipitation_history']), 15 * 12)
+
+
+if __name__ == '__main__':
+    unittest.main()